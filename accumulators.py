@@ -0,0 +1,143 @@
+"""
+Mergeable streaming accumulators for Monte Carlo metrics.
+
+A MetricAccumulator keeps counts, exact sums and sums of squares and a
+fixed-bin histogram for quantiles, so memory does not grow with the number of
+replicates. Every float is a multiple of 2**-1074, so the sums are held as
+Python integers in those units; merge() is then exact integer addition, and
+accumulators built on different chunks, processes or nodes combine to the same
+bits in any order. Quantiles come from the histogram and are accurate to one
+bin width.
+"""
+
+import numpy as np
+from constants import HISTOGRAM_BINS
+
+SUM_SCALE_BITS = 1074
+
+def _scaledInteger(value):
+    numerator, denominator = float(value).as_integer_ratio()
+    return numerator << (SUM_SCALE_BITS + 1 - denominator.bit_length())
+
+_scaledIntegers = np.frompyfunc(_scaledInteger, 1, 1)
+
+# correctly rounded numerator / (denominator * 2**bits), NaN for an empty slot
+_exactRatio = np.frompyfunc(
+    lambda numerator, denominator, bits: numerator / (int(denominator) << bits) if denominator else np.nan, 3, 1
+)
+
+class MetricAccumulator:
+    """
+    Running summary of one metric, optionally with a per-slot shape (e.g. one
+    slot per alpha). NaN values are skipped, matching np.nanmean; other values
+    must be finite.
+    """
+
+    def __init__(self, shape=(), low=0.0, high=1.0, bins=HISTOGRAM_BINS):
+        self.shape = tuple(shape)
+        self.low = float(low)
+        self.high = float(high)
+        self.bins = int(bins)
+
+        self.count = np.zeros(self.shape)
+        self.total = np.zeros(self.shape, dtype=object)
+        self.totalSquares = np.zeros(self.shape, dtype=object)
+        self.minimum = np.full(self.shape, np.inf)
+        self.maximum = np.full(self.shape, -np.inf)
+        self.histogram = np.zeros(self.shape + (self.bins,), dtype=np.int64)
+
+    def _combine(self, count, total, totalSquares):
+        self.count = self.count + count
+        self.total = np.asarray(self.total + total, dtype=object)
+        self.totalSquares = np.asarray(self.totalSquares + totalSquares, dtype=object)
+
+    def update(self, values):
+        """Add a batch of values shaped (n,) + shape."""
+        values = np.asarray(values, dtype=float).reshape((-1,) + self.shape)
+        valid = ~np.isnan(values)
+
+        exact = _scaledIntegers(np.where(valid, values, 0.0))
+        self._combine(valid.sum(axis=0), exact.sum(axis=0), (exact * exact).sum(axis=0))
+        self.minimum = np.minimum(self.minimum, np.where(valid, values, np.inf).min(axis=0))
+        self.maximum = np.maximum(self.maximum, np.where(valid, values, -np.inf).max(axis=0))
+
+        scaled = (values - self.low) / (self.high - self.low) * self.bins
+        binIndex = np.clip(np.floor(np.where(valid, scaled, 0)), 0, self.bins - 1).astype(np.int64)
+
+        slots = np.broadcast_to(np.arange(int(np.prod(self.shape))).reshape(self.shape), values.shape)
+        np.add.at(self.histogram.reshape(-1, self.bins), (slots[valid], binIndex[valid]), 1)
+
+        return self
+
+    def merge(self, other):
+        if (self.shape, self.low, self.high, self.bins) != (other.shape, other.low, other.high, other.bins):
+            raise ValueError("cannot merge accumulators with different layouts")
+
+        self._combine(other.count, other.total, other.totalSquares)
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.histogram = self.histogram + other.histogram
+
+        return self
+
+    def _result(self, values):
+        # scalar accumulators report plain floats
+        return values[()] if self.shape == () else values
+
+    def variance(self):
+        # population variance, as np.std: (n * sum x^2 - (sum x)^2) / n^2, rounded once
+        counts = self.count.astype(np.int64).astype(object)
+        numerator = counts * self.totalSquares - self.total * self.total
+        return self._result(np.asarray(_exactRatio(numerator, counts * counts, 2 * SUM_SCALE_BITS), dtype=float))
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def standardError(self):
+        return np.sqrt(self.variance() / np.maximum(self.count, 1))
+
+    def finalMean(self):
+        return self._result(np.asarray(_exactRatio(self.total, self.count.astype(np.int64).astype(object), SUM_SCALE_BITS), dtype=float))
+
+    def quantile(self, percentiles):
+        """
+        Histogram quantiles, interpolated within bins and clipped to the observed
+        range; shape (len(percentiles),) + shape.
+        """
+        percentiles = np.atleast_1d(np.asarray(percentiles, dtype=float)) / 100.0
+        cumulative = np.cumsum(self.histogram, axis=-1)
+        width = (self.high - self.low) / self.bins
+
+        result = np.full((len(percentiles),) + self.shape, np.nan)
+        for i, q in enumerate(percentiles):
+            rank = q * self.count
+            binIndex = np.minimum(np.sum(cumulative < rank[..., None], axis=-1), self.bins - 1)
+
+            before = np.take_along_axis(cumulative, binIndex[..., None], axis=-1)[..., 0] \
+                - np.take_along_axis(self.histogram, binIndex[..., None], axis=-1)[..., 0]
+            inBin = np.take_along_axis(self.histogram, binIndex[..., None], axis=-1)[..., 0]
+
+            fraction = np.clip((rank - before) / np.maximum(inBin, 1), 0.0, 1.0)
+            value = np.clip(self.low + (binIndex + fraction) * width, self.minimum, self.maximum)
+            result[i] = np.where(self.count > 0, value, np.nan)
+
+        return result
+
+def mergeAccumulatorTrees(left, right):
+    """Merge two nested dicts of accumulators with the same keys into left."""
+    for key, value in right.items():
+        if isinstance(value, dict):
+            mergeAccumulatorTrees(left[key], value)
+        else:
+            left[key].merge(value)
+
+    return left
+
+def replicateCount(accumulators):
+    """Largest number of observations held by any accumulator in a nested dict."""
+    counts = [
+        replicateCount(value) if isinstance(value, dict) else int(np.max(value.count))
+        for value in accumulators.values()
+    ]
+
+    return max(counts, default=0)
@@ -1,20 +1,26 @@
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
 from baseline import *
 from constants import (
     TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH,
     BASEPHI, BASERHO, ALPHA, NUMBERREPS, NUMBERBOOTSTRAP, computeBlockLength,
-    PHI_LEVELS, RHO_LEVELS
+    PHI_LEVELS, RHO_LEVELS, BOOTSTRAP_MEMORY_BUDGET, BOOTSTRAP_SCHEME, CLUSTER_DRAWS_PER_TIME_RESAMPLE, SEED, COMMON_RANDOM_NUMBERS,
+    TSTAR_HISTOGRAM_MAX, HAC_MAX_LAG, HAC_BANDWIDTHS, SEQUENTIAL_BOOTSTRAP, SEQUENTIAL_BOOTSTRAP_BATCH, SEQUENTIAL_BOOTSTRAP_CONFIDENCE,
+    SEQUENTIAL_BOOTSTRAP_EXCEEDANCES, HAC_MAX_AUTO_LAG
 )
+from random_streams import replicateGenerator
+from scheduler import runChunkedWorkUnits, accumulateAdaptively
+from result_cache import cachedAccumulate
+from kernels import useNumba, gatheredHacTStatsKernel, romanoWolfExceedanceKernel
 
-def movingBlockBootstrap(data, blockLength, numberBootstrap):
+def movingBlockBootstrap(data, blockLength, numberBootstrap, rng=None):
+    rng = np.random if rng is None else rng
     time, _ = data.shape
     numBlocks = int(np.ceil(time / blockLength))
     maxStart = time - blockLength
     bootstrapSamples = []
     
     for b in range(numberBootstrap):
-        blockStarts = np.random.choice(maxStart + 1, size=numBlocks, replace=True)
+        blockStarts = rng.choice(maxStart + 1, size=numBlocks, replace=True)
         
         bootstrapData = []
         for start in blockStarts:
@@ -27,14 +33,15 @@ def movingBlockBootstrap(data, blockLength, numberBootstrap):
     
     return bootstrapSamples
 
-def clusterBootstrap(data, clusterLabels, numberBootstrap):
+def clusterBootstrap(data, clusterLabels, numberBootstrap, rng=None):
+    rng = np.random if rng is None else rng
     uniqueClusters = np.unique(clusterLabels)
     numberClusters = len(uniqueClusters)
 
     bootstrapSamples = []
 
     for b in range(numberBootstrap):
-        selectedClusters = np.random.choice(uniqueClusters, size=numberClusters, replace=True)
+        selectedClusters = rng.choice(uniqueClusters, size=numberClusters, replace=True)
 
         bootstrapData = []
         for clusterID in selectedClusters:
@@ -47,50 +54,401 @@ def clusterBootstrap(data, clusterLabels, numberBootstrap):
 
     return bootstrapSamples
 
-def movingBlockClusterBootstrap(data, clusterLabels, blockLength, numberBootstrap):
-    time, _ = data.shape
+def drawBootstrapPlan(time, clusterLabels, blockLength, numberBootstrap, rng=None, clusterDraws=CLUSTER_DRAWS_PER_TIME_RESAMPLE):
+    """
+    Draw compact index plans for the moving-block cluster bootstrap.
+
+    Each replicate is fully described by its block starts and its selected
+    clusters, so B replicates cost O(B * (T / blockLength + numberClusters))
+    integers instead of B copies of the panel. With clusterDraws > 1, runs of
+    that many consecutive replicates share a time resample and differ only in
+    their cluster draw, which the factorized scheme evaluates almost for free.
+    """
+    rng = np.random if rng is None else rng
     uniqueClusters = np.unique(clusterLabels)
     numberClusters = len(uniqueClusters)
 
     numBlocks = int(np.ceil(time / blockLength))
     maxStart = time - blockLength
 
-    bootstrapSamples = []
+    if clusterDraws > 1:
+        timeResamples = -(-numberBootstrap // clusterDraws)
+        blockStarts = rng.choice(maxStart + 1, size=(timeResamples, numBlocks), replace=True)
+        blockStarts = np.repeat(blockStarts, clusterDraws, axis=0)[:numberBootstrap]
+    else:
+        blockStarts = rng.choice(maxStart + 1, size=(numberBootstrap, numBlocks), replace=True)
+    selectedClusters = rng.choice(uniqueClusters, size=(numberBootstrap, numberClusters), replace=True)
+
+    return {
+        'time': time,
+        'blockLength': blockLength,
+        'blockStarts': blockStarts,
+        'selectedClusters': selectedClusters
+    }
 
-    for b in range(numberBootstrap):
+def drawMultiplierPlan(time, clusterLabels, blockLength, numberBootstrap, rng=None, bandwidth=HAC_MAX_LAG + 1):
+    """
+    Draw Gaussian innovations for the dependent wild (multiplier) bootstrap.
+
+    Replicate b weights period t of every firm in cluster c by the moving average
+    sum(multipliers[b, c, t:t + bandwidth]) / sqrt(bandwidth) of iid standard
+    normals, whose autocorrelation is the Bartlett kernel 1 - |t - s| / bandwidth.
+    With bandwidth HAC_MAX_LAG + 1 the bootstrap variance of a weighted column
+    mean is the Newey-West variance behind the HAC denominator, so blockLength is
+    only recorded in the plan.
+    """
+    rng = np.random if rng is None else rng
+    numberClusters = len(np.unique(clusterLabels))
+
+    return {
+        'time': time,
+        'blockLength': blockLength,
+        'bandwidth': bandwidth,
+        'multipliers': rng.standard_normal((numberBootstrap, numberClusters, time + bandwidth - 1))
+    }
 
-        blockStarts = np.random.choice(maxStart + 1, size=numBlocks, replace=True)
-        timeBootstrapData = []
-        for start in blockStarts:
-            block = data[start:start + blockLength, :]
-            timeBootstrapData.append(block)
+def drawResamplingPlan(time, clusterLabels, blockLength, numberBootstrap, rng=None, scheme=BOOTSTRAP_SCHEME):
+    if scheme == 'multiplier':
+        return drawMultiplierPlan(time, clusterLabels, blockLength, numberBootstrap, rng)
+    return drawBootstrapPlan(time, clusterLabels, blockLength, numberBootstrap, rng)
 
-        timeBootstrapData = np.vstack(timeBootstrapData)[:time, :]
+def planSize(plan):
+    return len(plan['multipliers'] if 'multipliers' in plan else plan['blockStarts'])
 
-        selectedClusters = np.random.choice(uniqueClusters, size=numberClusters, replace=True)
-        bootstrapData = []
-        for clusterID in selectedClusters:
-            firmIndices = np.where(clusterLabels == clusterID)[0]
-            clusterData = timeBootstrapData[:, firmIndices]
-            bootstrapData.append(clusterData)
+def planTimeIndices(plan, rows=slice(None)):
+    blockStarts = plan['blockStarts'][rows]
+    offsets = np.arange(plan['blockLength'])
+    timeIndices = (blockStarts[:, :, None] + offsets).reshape(blockStarts.shape[0], -1)
 
-        bootstrapData = np.hstack(bootstrapData)
-        bootstrapSamples.append(bootstrapData)
+    return timeIndices[:, :plan['time']]
+
+def clusterMembers(clusterLabels):
+    uniqueClusters = np.unique(clusterLabels)
+    return uniqueClusters, [np.where(clusterLabels == clusterID)[0] for clusterID in uniqueClusters]
+
+def equalClusterSizes(clusterLabels):
+    return len(set(np.unique(clusterLabels, return_counts=True)[1])) == 1
+
+def planColumnIndices(plan, clusterLabels, rows=slice(None)):
+    """
+    (b, K) source columns of the replicates plan[rows].
+
+    With clusters of equal size, replicate columns are the selected clusters'
+    members side by side. With ragged clusters a replicate keeps K columns: the
+    i-th firm of the cluster in slot c is replaced by firm i (mod its size) of
+    the cluster drawn for that slot.
+    """
+    uniqueClusters, members = clusterMembers(clusterLabels)
+    selected = np.searchsorted(uniqueClusters, plan['selectedClusters'][rows])
+    if equalClusterSizes(clusterLabels):
+        return np.vstack(members)[selected].reshape(selected.shape[0], -1)
+
+    sizes = np.array([len(firms) for firms in members])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    slots = np.searchsorted(uniqueClusters, clusterLabels)
+    withinCluster = np.empty(len(clusterLabels), dtype=int)
+    for firms in members:
+        withinCluster[firms] = np.arange(len(firms))
+
+    sources = selected[:, slots]
+    return np.concatenate(members)[offsets[sources] + withinCluster % sizes[sources]]
+
+def iterBootstrapChunks(data, clusterLabels, plan, memoryBudget=BOOTSTRAP_MEMORY_BUDGET):
+    """
+    Gather bootstrap replicates from an index plan in chunks.
+
+    Yields (rows, chunk) pairs where chunk is a (b, T, K) array holding the
+    replicates plan[rows]; b is chosen so that a chunk stays within memoryBudget bytes.
+    """
+    time, K = data.shape
+    numberBootstrap = plan['blockStarts'].shape[0]
+    chunkSize = int(max(1, min(numberBootstrap, memoryBudget // (time * K * data.itemsize))))
+
+    for start in range(0, numberBootstrap, chunkSize):
+        rows = slice(start, min(start + chunkSize, numberBootstrap))
+        timeIndices = planTimeIndices(plan, rows)
+        columnIndices = planColumnIndices(plan, clusterLabels, rows)
+        yield rows, data[timeIndices[:, :, None], columnIndices[:, None, :]]
+
+def movingBlockClusterBootstrap(data, clusterLabels, blockLength, numberBootstrap, rng=None):
+    time, _ = data.shape
+    plan = drawBootstrapPlan(time, clusterLabels, blockLength, numberBootstrap, rng)
+    timeIndices = planTimeIndices(plan)
+    uniqueClusters, members = clusterMembers(clusterLabels)
+    selected = np.searchsorted(uniqueClusters, plan['selectedClusters'])
+
+    bootstrapSamples = []
+
+    for b in range(numberBootstrap):
+        firmIndices = np.concatenate([members[c] for c in selected[b]])
+        bootstrapSamples.append(data[np.ix_(timeIndices[b], firmIndices)])
 
     return bootstrapSamples
 
-def computeBootstrapMaxStats(data, clusterLabels, blockLength, numberBootstrap):
-    centeredData = data - np.mean(data, axis=0, keepdims=True)
+def centerColumns(data):
+    # the mean is accumulated in float64 even for float32 panels
+    return (data - np.mean(data, axis=0, keepdims=True, dtype=np.float64)).astype(data.dtype, copy=False)
+
+def blockSufficientStatistics(data, blockLength, maxLag=HAC_MAX_LAG):
+    """
+    Per-start block tables of a (T, K) panel for the moving-block bootstrap.
+
+    blockSums[s] is the sum of rows s..s+blockLength-1 and withinProducts[s, l]
+    the sum of x_t * x_{t-l} over the pairs inside that block, both read off
+    prefix sums, so every one of the T - blockLength + 1 blocks costs O(K * maxLag).
+    """
+    x = np.asarray(data, dtype=float)
+    T, K = x.shape
+    starts = np.arange(T - blockLength + 1)
+
+    prefix = np.concatenate([np.zeros((1, K)), np.cumsum(x, axis=0)])
+    withinProducts = np.zeros((len(starts), maxLag + 1, K))
+    for lag in range(min(maxLag, blockLength - 1) + 1):
+        # productPrefix[i] sums x_{j+lag} * x_j over j < i
+        productPrefix = np.concatenate([np.zeros((1, K)), np.cumsum(x[lag:] * x[:T - lag], axis=0)])
+        withinProducts[:, lag] = productPrefix[starts + blockLength - lag] - productPrefix[starts]
+
+    return {
+        'blockLength': blockLength,
+        'maxLag': maxLag,
+        'blockSums': prefix[starts + blockLength] - prefix[starts],
+        'withinProducts': withinProducts
+    }
 
-    bootstrapSamples = movingBlockClusterBootstrap(centeredData, clusterLabels, blockLength, numberBootstrap)
-    maxStats = []
+def blockStatisticsTStats(data, clusterLabels, plan, tables=None, memoryBudget=BOOTSTRAP_MEMORY_BUDGET):
+    """
+    Bootstrap HAC t-stats assembled from block tables instead of gathered replicates.
+
+    A replicate's sum and lag products inside whole blocks come from gathers over
+    its block starts; only pairs crossing a junction (t mod blockLength < l) and
+    the truncated last block are multiplied directly. The HAC t-stat of a column
+    depends only on its source firm and the time resample, so t-stats are formed
+    per source firm and then gathered through the cluster draw. Per replicate this
+    is O(numBlocks * K * maxLag) plus the junction pairs, which only saves work
+    when blockLength exceeds maxLag: at the default blockLength of 2 (7 of the 8
+    grid scenarios) nearly every lag pair crosses a junction and this is slower
+    than gathering. tables, from blockSufficientStatistics of the same data and
+    blockLength, can be built once and shared by every plan of a dataset.
+    """
+    x = np.asarray(data, dtype=float)
+    T, K = x.shape
+    blockLength = plan['blockLength']
+    if tables is None:
+        tables = blockSufficientStatistics(x, blockLength)
+    maxLag = min(tables['maxLag'], T - 1)
+
+    fullBlocks = T // blockLength
+    tailStart = fullBlocks * blockLength
+    directPositions = {
+        lag: np.array([t for t in range(lag, T) if t >= tailStart or t % blockLength < lag], dtype=int)
+        for lag in range(1, maxLag + 1)
+    }
+
+    numberBootstrap = plan['blockStarts'].shape[0]
+    firmTStats = np.empty((numberBootstrap, K))
+    bytesPerReplicate = (fullBlocks * (maxLag + 2) + 2 * T) * K * 8
+    chunkSize = int(max(1, min(numberBootstrap, memoryBudget // bytesPerReplicate)))
+
+    for start in range(0, numberBootstrap, chunkSize):
+        rows = slice(start, min(start + chunkSize, numberBootstrap))
+        starts = plan['blockStarts'][rows, :fullBlocks]
+        timeIndices = planTimeIndices(plan, rows)
+        tailValues = x[timeIndices[:, tailStart:]]
+
+        total = tables['blockSums'][starts].sum(axis=1) + tailValues.sum(axis=1)
+        crossProducts = tables['withinProducts'][starts].sum(axis=1)
+        crossProducts[:, 0] += np.sum(tailValues**2, axis=1)
+        for lag, positions in directPositions.items():
+            crossProducts[:, lag] += np.sum(x[timeIndices[:, positions]] * x[timeIndices[:, positions - lag]], axis=1)
+
+        mean = total / T
+        edgeSums = np.cumsum(x[timeIndices[:, :maxLag]], axis=1), np.cumsum(x[timeIndices[:, ::-1][:, :maxLag]], axis=1)
+        varHat = crossProducts[:, 0] / T - mean**2
+        for lag in range(1, maxLag + 1):
+            # centered autocovariance from raw sums, as in OnlineHACState
+            innerSum = 2 * total - edgeSums[0][:, lag - 1] - edgeSums[1][:, lag - 1]
+            covariance = (crossProducts[:, lag] - mean * innerSum + (T - lag) * mean**2) / T
+            varHat += 2.0 * (1.0 - lag / (tables['maxLag'] + 1.0)) * covariance
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            se = np.sqrt(varHat / T)
+            firmTStats[rows] = np.where(se == 0, np.nan, mean / se)
+
+    return np.take_along_axis(firmTStats, planColumnIndices(plan, clusterLabels), axis=1)
+
+def uniqueTimeResamples(plan):
+    """The plan restricted to its distinct time resamples, and the row of each replicate in it."""
+    uniqueStarts, timeGroups = np.unique(plan['blockStarts'], axis=0, return_inverse=True)
+    return dict(plan, blockStarts=uniqueStarts), timeGroups.ravel()
+
+def timeResampleTStats(data, timePlan, memoryBudget=BOOTSTRAP_MEMORY_BUDGET, pValues=True):
+    """(U, K) t-stats, and p-values unless pValues is False, of the columns of data under each time resample."""
+    time, K = data.shape
+    numberResamples = len(timePlan['blockStarts'])
+    firmTStats = np.zeros((numberResamples, K), dtype=data.dtype)
+    firmPVals = np.zeros((numberResamples, K), dtype=data.dtype) if pValues else None
+    chunkSize = int(max(1, min(numberResamples, memoryBudget // (time * K * data.itemsize))))
+    for start in range(0, numberResamples, chunkSize):
+        rows = slice(start, min(start + chunkSize, numberResamples))
+        chunk = data[planTimeIndices(timePlan, rows)]
+        if pValues:
+            firmTStats[rows], firmPVals[rows] = computeTestStatistics(chunk)
+        else:
+            firmTStats[rows] = np.nan_to_num(hacTStats(chunk), nan=0.0)
+
+    return firmTStats, firmPVals
+
+def timeResampleFirmTStats(data, plan, memoryBudget=BOOTSTRAP_MEMORY_BUDGET, pValues=True):
+    """
+    t-stats of the original K columns under every distinct time resample of a plan.
+
+    Cluster resampling only duplicates whole column groups, so a replicate's
+    t-stats are a gather of these. Returns (firmTStats, firmPVals, timeGroups), the
+    first two of shape (U, K), where timeGroups maps each replicate to its row;
+    firmPVals is None without pValues.
+    """
+    timePlan, timeGroups = uniqueTimeResamples(plan)
+    firmTStats, firmPVals = timeResampleTStats(data, timePlan, memoryBudget, pValues)
+
+    return firmTStats, firmPVals, timeGroups
+
+def clusterMaxima(firmAbsTStats, clusterLabels):
+    _, members = clusterMembers(clusterLabels)
+    return np.stack([firmAbsTStats[:, firms].max(axis=1) for firms in members], axis=1)
+
+def factorizedMaxStats(data, clusterLabels, plan):
+    """Bootstrap max |t| as the max of the selected clusters' maxima; works for clusters of any size."""
+    firmTStats, _, timeGroups = timeResampleFirmTStats(data, plan, pValues=False)
+    return selectedClusterMaxStats(firmTStats, timeGroups, clusterLabels, plan)
+
+def selectedClusterMaxStats(firmTStats, timeGroups, clusterLabels, plan):
+    maxima = clusterMaxima(np.abs(firmTStats), clusterLabels)
+    selected = np.searchsorted(np.unique(clusterLabels), plan['selectedClusters'])
+
+    return np.max(maxima[timeGroups[:, None], selected], axis=1)
+
+def clusterWeightedSums(weights, values, members):
+    """sum_t weights[b, c, t] * values[t, k] over the clusters c of the columns k, as (B, K) batched matrix products."""
+    sums = np.empty((len(weights), values.shape[1]), dtype=values.dtype)
+    if len(set(len(firms) for firms in members)) == 1:
+        memberMatrix = np.vstack(members)
+        clusterSums = np.matmul(weights.transpose(1, 0, 2), values[:, memberMatrix].transpose(1, 0, 2))
+        sums[:, memberMatrix] = clusterSums.transpose(1, 0, 2)
+    else:
+        for c, firms in enumerate(members):
+            sums[:, firms] = weights[:, c, :] @ values[:, firms]
+
+    return sums
+
+def multiplierTStats(data, clusterLabels, plan, memoryBudget=BOOTSTRAP_MEMORY_BUDGET):
+    """
+    Dependent wild bootstrap t-stats of the (centered) columns of data, NaN where se is zero.
+
+    Replicate b is y_t = w_t * x_t with the cluster's weights w from the plan's
+    innovations, studentized by its own HAC standard error like a gathered
+    replicate. Every sum it needs is a weighted sum over time: the mean from
+    w_t against x_t and the lag-l products from w_t * w_{t-l} against
+    x_t * x_{t-l}, so each is a (B, T) x (T, K_c) matrix product per cluster and
+    replicates are never materialized. The centered autocovariances follow from
+    these raw sums as in blockStatisticsTStats.
+    """
+    time, K = data.shape
+    bandwidth = plan['bandwidth']
+    maxLag = min(HAC_MAX_LAG, time - 1)
+    _, members = clusterMembers(clusterLabels)
+
+    numberBootstrap = len(plan['multipliers'])
+    bootT = np.empty((numberBootstrap, K))
+    chunkSize = int(max(1, min(numberBootstrap, memoryBudget // ((maxLag + 5) * K * 8))))
+
+    for start in range(0, numberBootstrap, chunkSize):
+        rows = slice(start, min(start + chunkSize, numberBootstrap))
+        # moving sums of bandwidth innovations: Bartlett autocorrelation 1 - |t - s| / bandwidth
+        cumulative = np.cumsum(plan['multipliers'][rows], axis=2)
+        weights = np.concatenate([cumulative[:, :, bandwidth - 1:bandwidth], cumulative[:, :, bandwidth:] - cumulative[:, :, :-bandwidth]], axis=2)
+        weights = (weights / np.sqrt(bandwidth)).astype(data.dtype, copy=False)
+
+        total = clusterWeightedSums(weights, data, members).astype(float)
+        mean = total / time
+        gammas = np.empty((len(total), maxLag + 1, K))
+        for lag in range(maxLag + 1):
+            crossProducts = clusterWeightedSums(weights[:, :, lag:] * weights[:, :, :time - lag], data[lag:] * data[:time - lag], members)
+            # the first and last lag terms of y, left out of one of the two lagged sums
+            edgeSums = (clusterWeightedSums(weights[:, :, :lag], data[:lag], members)
+                        + clusterWeightedSums(weights[:, :, time - lag:], data[time - lag:], members)) if lag else 0.0
+            gammas[:, lag] = (crossProducts - mean * (2 * total - edgeSums) + (time - lag) * mean**2) / time
+
+        bootT[rows] = hacTStatsFromAutocovariances(mean, gammas, time, HAC_MAX_LAG)
+
+    return bootT
+
+def bootstrapStatisticsFromT(bootT, T, dtype, pValues=True):
+    if not pValues:
+        return np.nan_to_num(bootT, nan=0.0).astype(dtype, copy=False), None
+
+    tStats, pVals = testStatisticsFromT(bootT, T)
+    return tStats.astype(dtype, copy=False), pVals.astype(dtype, copy=False)
+
+# streams replicates from the plan, keeping only the (B, K) statistics in the panel's precision;
+# without pValues the (B, K) p-values, often the dominant cost, are skipped and None is returned;
+# tables are the blockStatistics scheme's block tables, built here when not given
+def computeBootstrapTStats(data, clusterLabels, plan, scheme=BOOTSTRAP_SCHEME, pValues=True, tables=None,
+                           memoryBudget=BOOTSTRAP_MEMORY_BUDGET):
+    # multiplier plans carry weights instead of indices, whatever the scheme
+    if 'multipliers' in plan:
+        return bootstrapStatisticsFromT(multiplierTStats(data, clusterLabels, plan, memoryBudget), data.shape[0], data.dtype, pValues)
+
+    numberBootstrap = plan['blockStarts'].shape[0]
+
+    if scheme == 'factorized':
+        firmTStats, firmPVals, timeGroups = timeResampleFirmTStats(data, plan, memoryBudget, pValues)
+        columnIndices = planColumnIndices(plan, clusterLabels)
+        return (np.take_along_axis(firmTStats[timeGroups], columnIndices, axis=1),
+                np.take_along_axis(firmPVals[timeGroups], columnIndices, axis=1) if pValues else None)
+
+    if scheme == 'blockStatistics':
+        bootT = blockStatisticsTStats(data, clusterLabels, plan, tables, memoryBudget)
+        return bootstrapStatisticsFromT(bootT, data.shape[0], data.dtype, pValues)
+
+    if useNumba():
+        # fused gather and HAC: replicates are never materialized
+        bootT = gatheredHacTStatsKernel(data, planTimeIndices(plan), planColumnIndices(plan, clusterLabels), HAC_MAX_LAG)
+        return bootstrapStatisticsFromT(bootT, data.shape[0], data.dtype, pValues)
+
+    tStats = np.zeros((numberBootstrap, data.shape[1]), dtype=data.dtype)
+    pVals = np.zeros((numberBootstrap, data.shape[1]), dtype=data.dtype) if pValues else None
+
+    for rows, chunk in iterBootstrapChunks(data, clusterLabels, plan, memoryBudget):
+        if pValues:
+            tStats[rows], pVals[rows] = computeTestStatistics(chunk)
+        else:
+            tStats[rows] = np.nan_to_num(hacTStats(chunk), nan=0.0)
 
-    for bootstrapData in bootstrapSamples:
-        tStats, _ = computeTestStatistics(bootstrapData)
-        maxStat = np.max(np.abs(tStats))
-        maxStats.append(maxStat)
+    return tStats, pVals
 
-    return np.array(maxStats)
+def computeBootstrapMaxStats(data, clusterLabels, blockLength, numberBootstrap, rng=None, sequentialAlpha=None,
+                             scheme=BOOTSTRAP_SCHEME):
+    centeredData = centerColumns(data)
+
+    # ragged clusters take the max over the selected clusters' full membership, as a gathered replicate would
+    ragged = scheme != 'multiplier' and not equalClusterSizes(clusterLabels)
+    if sequentialAlpha is None:
+        plan = drawResamplingPlan(data.shape[0], clusterLabels, blockLength, numberBootstrap, rng, scheme)
+        if scheme == 'factorized' or ragged:
+            return factorizedMaxStats(centeredData, clusterLabels, plan)
+        tStats, _ = computeBootstrapTStats(centeredData, clusterLabels, plan, scheme, pValues=False)
+    else:
+        scheme = 'factorized' if ragged else scheme
+        tables = blockSufficientStatistics(centeredData, blockLength) if scheme == 'blockStatistics' else None
+        tStats, plan, *_ = drawSequentialBootstrapT(
+            centeredData, clusterLabels, blockLength, numberBootstrap,
+            np.abs(computeTestStatistics(data)[0]), sequentialAlpha, rng, scheme=scheme, tables=tables
+        )
+        if ragged:
+            return factorizedMaxStats(centeredData, clusterLabels, plan)
+    maxStats = np.max(np.abs(tStats), axis=1)
+
+    return maxStats
 
 def effectiveNumberTests(maxStats, alpha, K, df):
     tStar = np.percentile(maxStats, 100 * (1 - alpha))
@@ -117,171 +475,459 @@ def effectiveNumberTests(maxStats, alpha, K, df):
 
     return kEff
 
-def applyBootstrapCalibration(data, clusterLabels, isTrue, alpha=ALPHA, blockLength=None, numberBootstrap=NUMBERBOOTSTRAP):
-    if blockLength is None:
-        raise ValueError("blockLength must be provided")
+def romanoWolfAdjustedPValues(absTStats, bootstrapAbsT):
+    """
+    Romano-Wolf step-down adjusted p-values for all K hypotheses in O(B * K).
+
+    Hypotheses are ordered by decreasing |t|; the max over the remaining set at
+    step k is the reverse cumulative maximum of the bootstrap |t| columns in that
+    order. Enforcing monotonicity with a running maximum makes pAdj < alpha
+    reproduce the sequential step-down at every alpha.
+    """
+    sortedIndices = np.argsort(absTStats)[::-1]
+    counts = romanoWolfExceedanceCounts(absTStats[sortedIndices], bootstrapAbsT[:, sortedIndices])
+
+    return romanoWolfPAdjFromCounts(counts, bootstrapAbsT.shape[0], sortedIndices)
+
+# counts add up over replicate chunks, so (B, K) matrices on disk can be streamed
+def romanoWolfExceedanceCounts(sortedStats, sortedBoot):
+    if useNumba():
+        return romanoWolfExceedanceKernel(sortedStats, np.ascontiguousarray(sortedBoot))
+
+    maxStatsRemaining = np.maximum.accumulate(sortedBoot[:, ::-1], axis=1)[:, ::-1]
+    return np.sum(maxStatsRemaining >= sortedStats, axis=0)
+
+def romanoWolfPAdjFromCounts(counts, numberBootstrap, sortedIndices):
+    sortedPAdj = np.maximum.accumulate(counts / numberBootstrap)
+
+    pAdj = np.empty_like(sortedPAdj)
+    pAdj[sortedIndices] = sortedPAdj
+
+    return pAdj
+
+def clopperPearsonInterval(counts, n, confidence=SEQUENTIAL_BOOTSTRAP_CONFIDENCE):
+    tail = (1 - confidence) / 2
+    lower = np.where(counts > 0, stats.beta.ppf(tail, np.maximum(counts, 1), n - counts + 1), 0.0)
+    upper = np.where(counts < n, stats.beta.ppf(1 - tail, counts + 1, np.maximum(n - counts, 1)), 1.0)
+
+    return lower, upper
+
+def besagCliffordPValues(exceeds, alpha, exceedances=SEQUENTIAL_BOOTSTRAP_EXCEEDANCES,
+                         confidence=SEQUENTIAL_BOOTSTRAP_CONFIDENCE):
+    """
+    Sequential p-values from the (n, K) exceedance indicators drawn so far.
+
+    A column stops at its h-th exceedance with p = h / (draws up to it), as in
+    Besag and Clifford (1991), and is then settled. Columns short of h keep the
+    running estimate count / n, which is their fixed-B p-value once the cap is
+    reached; they settle early only as rejections, once the Clopper-Pearson
+    upper bound of their exceedance rate is below alpha. Returns (pVals, settled).
+    """
+    n = exceeds.shape[0]
+    cumulative = np.cumsum(exceeds, axis=0)
+    counts = cumulative[-1]
+
+    stopped = counts >= exceedances
+    stoppingDraw = np.argmax(cumulative >= exceedances, axis=0) + 1
+    pVals = np.where(stopped, exceedances / stoppingDraw, counts / n)
+    _, upper = clopperPearsonInterval(counts, n, confidence)
+
+    return pVals, stopped | (upper < alpha)
+
+def sequentialBootstrapPValues(absTStats, bootstrapAbsT, alpha, exceedances=SEQUENTIAL_BOOTSTRAP_EXCEEDANCES,
+                               confidence=SEQUENTIAL_BOOTSTRAP_CONFIDENCE):
+    """
+    Besag-Clifford single-step and Romano-Wolf p-values of the draws so far.
+
+    Returns (singlePAdj, rwPAdj, settled). The step-down only needs its steps up
+    to the first settled acceptance, since every later hypothesis is accepted
+    through the running maximum; settled is whether those steps and every
+    single-step decision are settled.
+    """
+    sortedIndices = np.argsort(absTStats)[::-1]
+    sortedStats = absTStats[sortedIndices]
+    maxStatsRemaining = np.maximum.accumulate(bootstrapAbsT[:, sortedIndices][:, ::-1], axis=1)[:, ::-1]
+
+    singleP, singleSettled = besagCliffordPValues(maxStatsRemaining[:, :1] >= sortedStats, alpha, exceedances, confidence)
+    stepP, stepSettled = besagCliffordPValues(maxStatsRemaining >= sortedStats, alpha, exceedances, confidence)
+    sortedPAdj = np.maximum.accumulate(stepP)
+
+    acceptances = np.flatnonzero(stepSettled & (sortedPAdj >= alpha))
+    neededSteps = len(stepP) if len(acceptances) == 0 else acceptances[0] + 1
+    settled = bool(np.all(singleSettled) and np.all(stepSettled[:neededSteps]))
+
+    singlePAdj, rwPAdj = np.empty_like(singleP), np.empty_like(sortedPAdj)
+    singlePAdj[sortedIndices] = singleP
+    rwPAdj[sortedIndices] = sortedPAdj
+
+    return singlePAdj, rwPAdj, settled
+
+def drawSequentialBootstrapT(centeredData, clusterLabels, blockLength, maxBootstrap, absTStats, alpha, rng=None,
+                             batchSize=SEQUENTIAL_BOOTSTRAP_BATCH, confidence=SEQUENTIAL_BOOTSTRAP_CONFIDENCE,
+                             scheme=BOOTSTRAP_SCHEME, exceedances=SEQUENTIAL_BOOTSTRAP_EXCEEDANCES, tables=None):
+    """
+    Besag-Clifford sequential bootstrap: draw replicates in batches until every
+    decision at alpha is settled (see sequentialBootstrapPValues) or maxBootstrap
+    replicates are drawn, when unsettled decisions fall back to the fixed-B estimate.
+
+    Returns (bootT, plan, singlePAdj, rwPAdj) covering only the replicates actually drawn.
+    """
+    plans, bootTBatches = [], []
+    drawn = 0
+
+    while drawn < maxBootstrap:
+        batchPlan = drawResamplingPlan(
+            centeredData.shape[0], clusterLabels, blockLength, min(batchSize, maxBootstrap - drawn), rng, scheme
+        )
+        batchT, _ = computeBootstrapTStats(centeredData, clusterLabels, batchPlan, scheme, pValues=False, tables=tables)
+        plans.append(batchPlan)
+        bootTBatches.append(batchT)
+        drawn += len(batchT)
+
+        singlePAdj, rwPAdj, settled = sequentialBootstrapPValues(
+            absTStats, np.abs(np.vstack(bootTBatches)), alpha, exceedances, confidence
+        )
+        if settled:
+            break
+
+    plan = {
+        key: np.concatenate([batchPlan[key] for batchPlan in plans]) if isinstance(value, np.ndarray) else value
+        for key, value in plans[0].items()
+    }
+
+    return np.vstack(bootTBatches), plan, singlePAdj, rwPAdj
+
+def computeBootstrapNull(data, clusterLabels, blockLength, numberBootstrap, plan=None, rng=None, sequentialAlpha=None,
+                         scheme=BOOTSTRAP_SCHEME, memoryBudget=BOOTSTRAP_MEMORY_BUDGET):
+    """
+    Compute the bootstrap null distribution of one dataset once.
+
+    Holds the original t-stats and p-values together with the (B, K) matrix of
+    bootstrap |t| on the centered data, so the single-step threshold, kEff and
+    the Romano-Wolf step-down can all share one set of resamples. With
+    sequentialAlpha, replicates are drawn only until the decisions at that alpha
+    are settled; numberBootstrap then caps the draws, the count used is returned
+    and rwPAdj and singlePAdj hold the Besag-Clifford p-values.
+    scheme selects how replicate t-stats are computed (see computeBootstrapTStats);
+    the blockStatistics tables are built once here and shared by every batch.
+    Index plans on clusters of unequal size use the factorized scheme, and their
+    maxStats are the max over the selected clusters' full membership. memoryBudget
+    bounds the replicate working set of a fixed-size plan.
+    """
+    tStats, pVals = computeTestStatistics(data)
+
+    centeredData = centerColumns(data)
+    ragged = (scheme != 'multiplier' if plan is None else 'blockStarts' in plan) and not equalClusterSizes(clusterLabels)
+    if ragged:
+        scheme = 'factorized'
+    tables = None
+    if scheme == 'blockStatistics' and (plan is None or 'blockStarts' in plan):
+        tables = blockSufficientStatistics(centeredData, blockLength if plan is None else plan['blockLength'])
+
+    if plan is None and sequentialAlpha is not None:
+        bootT, plan, singlePAdj, rwPAdj = drawSequentialBootstrapT(
+            centeredData, clusterLabels, blockLength, numberBootstrap, np.abs(tStats), sequentialAlpha, rng,
+            scheme=scheme, tables=tables
+        )
+        bootstrapNull = dict(
+            assembleBootstrapNull(tStats, pVals, bootT, data.shape[0] - 1, plan), rwPAdj=rwPAdj, singlePAdj=singlePAdj
+        )
+        if ragged:
+            bootstrapNull['maxStats'] = factorizedMaxStats(centeredData, clusterLabels, plan)
+        return bootstrapNull
+
+    if plan is None:
+        plan = drawResamplingPlan(data.shape[0], clusterLabels, blockLength, numberBootstrap, rng, scheme)
+    if ragged:
+        firmTStats, _, timeGroups = timeResampleFirmTStats(centeredData, plan, memoryBudget, pValues=False)
+        bootT = np.take_along_axis(firmTStats[timeGroups], planColumnIndices(plan, clusterLabels), axis=1)
+        return dict(
+            assembleBootstrapNull(tStats, pVals, bootT, data.shape[0] - 1, plan),
+            maxStats=selectedClusterMaxStats(firmTStats, timeGroups, clusterLabels, plan)
+        )
+    bootT, _ = computeBootstrapTStats(centeredData, clusterLabels, plan, scheme, pValues=False, tables=tables,
+                                      memoryBudget=memoryBudget)
+
+    return assembleBootstrapNull(tStats, pVals, bootT, data.shape[0] - 1, plan)
+
+def computeJointBootstrapTStats(data, clusterLabels, plan):
+    """
+    Null and signal-preserving bootstrap t-stats from one set of resamples.
+
+    Resampling the raw and the centered panel with the same plan gives series
+    that differ by a per-column constant, so they share residuals and HAC
+    standard errors. Each gathered chunk gets its autocovariances once, and the
+    null t is (m* - mean of the source column) / se* while the stability t is
+    m* / se*. Returns (nullT, stabilityT, stabilityPVals) with invalid t-stats at 0.
+    """
+    time, K = data.shape
+    columnMeans = data.mean(axis=0, dtype=np.float64)
+    nullT = np.zeros((planSize(plan), K), dtype=data.dtype)
+    stabilityT = np.zeros((planSize(plan), K), dtype=data.dtype)
+    stabilityPVals = np.zeros((planSize(plan), K), dtype=data.dtype)
+
+    for rows, chunk in iterBootstrapChunks(data, clusterLabels, plan):
+        mu_hat, gammas = residualAutocovariances(chunk, HAC_MAX_LAG)
+        sourceMeans = columnMeans[planColumnIndices(plan, clusterLabels, rows)]
+        nullT[rows] = np.nan_to_num(hacTStatsFromAutocovariances(mu_hat - sourceMeans, gammas, time, HAC_MAX_LAG), nan=0.0)
+        stabilityT[rows], stabilityPVals[rows] = testStatisticsFromT(hacTStatsFromAutocovariances(mu_hat, gammas, time, HAC_MAX_LAG), time)
+
+    return nullT, stabilityT, stabilityPVals
+
+def assembleBootstrapNull(tStats, pVals, bootT, df, plan):
+    bootstrapAbsT = np.abs(bootT)
+
+    return {
+        'tStats': tStats,
+        'pVals': pVals,
+        'bootstrapAbsT': bootstrapAbsT,
+        'maxStats': np.max(bootstrapAbsT, axis=1),
+        'rwPAdj': romanoWolfAdjustedPValues(np.abs(tStats), bootstrapAbsT),
+        'df': df,
+        'plan': plan,
+        'numberBootstrap': len(bootstrapAbsT)
+    }
 
-    maxStats = computeBootstrapMaxStats(data, clusterLabels, blockLength, numberBootstrap)
+def computeBootstrapNullMultiBandwidth(data, clusterLabels, blockLength, numberBootstrap, bandwidths=HAC_BANDWIDTHS,
+                                       automatic=True, plan=None, rng=None, memoryBudget=BOOTSTRAP_MEMORY_BUDGET):
+    """
+    Bootstrap nulls for several HAC lags from one set of resamples.
+
+    Every gathered chunk gets its autocovariances computed once, and all lags,
+    plus the per-column Andrews lag when automatic, are read off them. Chunks
+    are sized so the gathered replicates and the autocovariance temporaries
+    together stay within memoryBudget.
+    Returns {lag: bootstrapNull} with 'auto' for the plug-in lag.
+    """
+    time, K = data.shape
+    tStatsByLag = multiBandwidthHacTStats(data, bandwidths, automatic)
+
+    centeredData = centerColumns(data)
+    if plan is None:
+        plan = drawBootstrapPlan(time, clusterLabels, blockLength, numberBootstrap, rng)
+
+    # the plug-in lag is data dependent, so the working set is sized for its cap
+    maxLag = max(max(bandwidths, default=0), HAC_MAX_AUTO_LAG if automatic else 0)
+    replicateBytes = time * K * centeredData.itemsize
+    workingBytes = autocovarianceWorkingBytes(time, K, maxLag, centeredData.itemsize)
+    chunkBudget = memoryBudget * replicateBytes // (replicateBytes + workingBytes)
+
+    bootTByLag = {lag: np.zeros((len(plan['blockStarts']), K)) for lag in tStatsByLag}
+    for rows, chunk in iterBootstrapChunks(centeredData, clusterLabels, plan, chunkBudget):
+        for lag, chunkT in multiBandwidthHacTStats(chunk, bandwidths, automatic).items():
+            bootTByLag[lag][rows] = np.nan_to_num(chunkT, nan=0.0)
+
+    nulls = {}
+    for lag, tStats in tStatsByLag.items():
+        tStats, pVals = testStatisticsFromT(tStats, time)
+        nulls[lag] = assembleBootstrapNull(tStats, pVals, bootTByLag[lag], time - 1, plan)
+
+    return nulls
+
+def applyBootstrapCalibration(data, clusterLabels, isTrue, alpha=ALPHA, blockLength=None, numberBootstrap=NUMBERBOOTSTRAP, bootstrapNull=None, rng=None,
+                              sequential=SEQUENTIAL_BOOTSTRAP):
+    if bootstrapNull is None:
+        if blockLength is None:
+            raise ValueError("blockLength must be provided")
+        bootstrapNull = computeBootstrapNull(
+            data, clusterLabels, blockLength, numberBootstrap, rng=rng, sequentialAlpha=alpha if sequential else None
+        )
+
+    maxStats = bootstrapNull['maxStats']
     tStar = np.percentile(maxStats, 100 * (1 - alpha))
 
-    tStats, _ = computeTestStatistics(data) # test statistics on original data
+    tStats = bootstrapNull['tStats'] # test statistics on original data
     K = len(tStats)
-    degreesFreedom = data.shape[0] - 1
 
-    kEff = effectiveNumberTests(maxStats, alpha, K, degreesFreedom)
+    kEff = effectiveNumberTests(maxStats, alpha, K, bootstrapNull['df'])
 
-    rejected = np.abs(tStats) > tStar
+    # sequential nulls decide on their Besag-Clifford p-values
+    rejected = bootstrapNull['singlePAdj'] < alpha if 'singlePAdj' in bootstrapNull else np.abs(tStats) > tStar
     performance = measurePerformance(rejected, isTrue)
     performance['tStar'] = tStar
     performance['kEff'] = kEff
+    performance['numberBootstrap'] = bootstrapNull['numberBootstrap']
 
     return performance, tStar, rejected
 
-def applyRomanoWolfBootstrapCalibration(data, clusterLabels, isTrue, alpha=ALPHA, blockLength=None, numberBootstrap=NUMBERBOOTSTRAP):
-    if blockLength is None:
-        raise ValueError("blockLength must be provided")
-
-    tStats, _ = computeTestStatistics(data)
-    K = len(tStats)
+def applyRomanoWolfBootstrapCalibration(data, clusterLabels, isTrue, alpha=ALPHA, blockLength=None, numberBootstrap=NUMBERBOOTSTRAP, bootstrapNull=None, rng=None,
+                                        sequential=SEQUENTIAL_BOOTSTRAP):
+    if bootstrapNull is None:
+        if blockLength is None:
+            raise ValueError("blockLength must be provided")
+        bootstrapNull = computeBootstrapNull(
+            data, clusterLabels, blockLength, numberBootstrap, rng=rng, sequentialAlpha=alpha if sequential else None
+        )
 
-    sortedIndices = np.argsort(np.abs(tStats))[::-1]
-    sortedStats = np.abs(tStats)[sortedIndices]
+    K = len(bootstrapNull['tStats'])
+    kEff = effectiveNumberTests(bootstrapNull['maxStats'], alpha, K, bootstrapNull['df'])
 
-    rejected = np.zeros(K, dtype=bool)
+    rejected = bootstrapNull['rwPAdj'] < alpha
 
-    centeredData = data - np.mean(data, axis=0, keepdims=True)
-    bootstrapSamples = movingBlockClusterBootstrap(centeredData, clusterLabels, blockLength, numberBootstrap)
+    performance = measurePerformance(rejected, isTrue)
+    performance['kEff'] = kEff
+    performance['numberBootstrap'] = bootstrapNull['numberBootstrap']
 
-    bootstrapTStats = []
-    for bootData in bootstrapSamples:
-        bootT, _ = computeTestStatistics(bootData)
-        bootstrapTStats.append(np.abs(bootT))
-    bootstrapTStats = np.array(bootstrapTStats)
+    return performance, rejected, kEff
 
-    maxStats = np.max(bootstrapTStats, axis=1)
-    degreesFreedom = data.shape[0] - 1
-    kEff = effectiveNumberTests(maxStats, alpha, K, degreesFreedom)
+BOOTSTRAP_METHODS = ['Bonferroni', 'Holm', 'BH', 'Bootstrap-Single', 'Bootstrap-RomanoWolf']
 
-    for k in range(K):
-        remainingIndices = sortedIndices[k:]
+def newBootstrapAccumulators(numberBootstrap=NUMBERBOOTSTRAP):
+    K = NUMBERCLUSTERS * FIRMSPERCLUSTER
+    accumulators = {}
+    for method in BOOTSTRAP_METHODS:
+        accumulators[method] = newPerformanceAccumulators()
+        accumulators[method]['kEff'] = MetricAccumulator(low=1.0, high=float(K))
+        accumulators[method]['bootstrapReps'] = MetricAccumulator(low=0.0, high=float(numberBootstrap))
+    accumulators['Bootstrap-Single']['tStar'] = MetricAccumulator(low=0.0, high=TSTAR_HISTOGRAM_MAX)
 
-        maxStatsRemaining = np.max(bootstrapTStats[:, remainingIndices], axis=1)
-        pAdj = np.mean(maxStatsRemaining >= sortedStats[k])
+    return accumulators
 
-        if pAdj < alpha:
-            rejected[sortedIndices[k]] = True
-        else:
-            break
+def accumulateWithBootstrap(phi, rho, replicates, alpha=ALPHA, numberBootstrap=NUMBERBOOTSTRAP, blockLength=None,
+                            seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS, sequentialBootstrap=SEQUENTIAL_BOOTSTRAP):
+    """Run the replicates in a range and return mergeable per-method accumulators."""
+    if blockLength is None:
+        blockLength = computeBlockLength(phi)
 
-    performance = measurePerformance(rejected, isTrue)
-    performance['kEff'] = kEff
+    accumulators = newBootstrapAccumulators(numberBootstrap)
 
-    return performance, rejected, kEff
+    for rep in replicates:
+        dataRng = replicateGenerator(phi, rho, rep, 'data', seed, commonRandomNumbers)
+        bootstrapRng = replicateGenerator(phi, rho, rep, 'bootstrap', seed, commonRandomNumbers)
 
-def monteCarloWithBootstrap(phi, rho, alpha=ALPHA, numReps=NUMBERREPS, numberBootstrap=NUMBERBOOTSTRAP, blockLength=None):
+        data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
+            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho, dataRng
+        )
+        bootstrapNull = computeBootstrapNull(
+            data, clusterLabels, blockLength, numberBootstrap, rng=bootstrapRng,
+            sequentialAlpha=alpha if sequentialBootstrap else None
+        )
+        updateBootstrapAccumulators(accumulators, data, clusterLabels, isTrue, bootstrapNull, alpha)
+
+    return accumulators
+
+def updateBootstrapAccumulators(accumulators, data, clusterLabels, isTrue, bootstrapNull, alpha):
+    for methodName, methodFunc in CLASSICAL_BATCH_METHODS.items():
+        performance = measurePerformanceBatch(methodFunc(bootstrapNull['tStats'], alpha, bootstrapNull['df'])[0], isTrue)
+        updatePerformanceAccumulators(accumulators[methodName], performance)
+        accumulators[methodName]['kEff'].update(np.nan)
+        accumulators[methodName]['bootstrapReps'].update(np.nan)
+
+    performanceBoot, tStar, _ = applyBootstrapCalibration(
+        data, clusterLabels, isTrue, alpha, bootstrapNull=bootstrapNull
+    )
+    updatePerformanceAccumulators(accumulators['Bootstrap-Single'], performanceBoot)
+    accumulators['Bootstrap-Single']['kEff'].update(performanceBoot['kEff'])
+    accumulators['Bootstrap-Single']['tStar'].update(tStar)
+    accumulators['Bootstrap-Single']['bootstrapReps'].update(performanceBoot['numberBootstrap'])
+
+    performanceRW, _, _ = applyRomanoWolfBootstrapCalibration(
+        data, clusterLabels, isTrue, alpha, bootstrapNull=bootstrapNull
+    )
+    updatePerformanceAccumulators(accumulators['Bootstrap-RomanoWolf'], performanceRW)
+    accumulators['Bootstrap-RomanoWolf']['kEff'].update(performanceRW['kEff'])
+    accumulators['Bootstrap-RomanoWolf']['bootstrapReps'].update(performanceRW['numberBootstrap'])
+
+def accumulateBandwidthSweep(phi, rho, replicates, bandwidths=HAC_BANDWIDTHS, alpha=ALPHA, numberBootstrap=NUMBERBOOTSTRAP,
+                             blockLength=None, seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS):
+    """accumulateWithBootstrap for every HAC lag in bandwidths and the Andrews lag, keyed by lag."""
     if blockLength is None:
         blockLength = computeBlockLength(phi)
 
-    methods = {
-        'Bonferroni': bonferroni,
-        'Holm': holm,
-        'BH': benjaminiHochberg,
-        'Bootstrap-Single': None,
-        'Bootstrap-RomanoWolf': None
-    }
+    accumulators = {lag: newBootstrapAccumulators(numberBootstrap) for lag in list(bandwidths) + ['auto']}
 
-    results = {method: {'fwer': [], 'fdr': [], 'power': [], 'kEff': []} for method in methods}
-    results['Bootstrap-Single']['tStars'] = []
+    for rep in replicates:
+        dataRng = replicateGenerator(phi, rho, rep, 'data', seed, commonRandomNumbers)
+        bootstrapRng = replicateGenerator(phi, rho, rep, 'bootstrap', seed, commonRandomNumbers)
 
-    for rep in range(numReps):
         data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
-            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho
-        )
-        tStats, pVals = computeTestStatistics(data)
-
-        for methodName, methodFunc in methods.items():
-            if 'Bootstrap' in methodName:
-                continue # special handling below
-
-            rejected = methodFunc(pVals, alpha)
-            performance = measurePerformance(rejected, isTrue)
-
-            results[methodName]['fwer'].append(performance['fwer'])
-            results[methodName]['fdr'].append(performance['fdr'])
-            results[methodName]['power'].append(performance['power'])
-            results[methodName]['kEff'].append(np.nan)
-
-        performanceBoot, tStar, _ = applyBootstrapCalibration(data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap)
-        results['Bootstrap-Single']['fwer'].append(performanceBoot['fwer'])
-        results['Bootstrap-Single']['fdr'].append(performanceBoot['fdr'])
-        results['Bootstrap-Single']['power'].append(performanceBoot['power'])
-        results['Bootstrap-Single']['tStars'].append(tStar)
-        results['Bootstrap-Single']['kEff'].append(performanceBoot['kEff'])
-
-
-        performanceRW, _, _ = applyRomanoWolfBootstrapCalibration(
-            data,
-            clusterLabels,
-            isTrue,
-            alpha,
-            blockLength,
-            numberBootstrap,
+            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho, dataRng
         )
-        results['Bootstrap-RomanoWolf']['fwer'].append(performanceRW['fwer'])
-        results['Bootstrap-RomanoWolf']['fdr'].append(performanceRW['fdr'])
-        results['Bootstrap-RomanoWolf']['power'].append(performanceRW['power'])
-        results['Bootstrap-RomanoWolf']['kEff'].append(performanceRW['kEff'])
+        nulls = computeBootstrapNullMultiBandwidth(data, clusterLabels, blockLength, numberBootstrap, bandwidths, rng=bootstrapRng)
 
+        for lag, bootstrapNull in nulls.items():
+            updateBootstrapAccumulators(accumulators[lag], data, clusterLabels, isTrue, bootstrapNull, alpha)
 
+    return accumulators
+
+def summarizeWithBootstrap(accumulators):
     summary = {}
-    for methodName in methods:
-        kEffValues = np.array(results[methodName]['kEff'])
-        hasKeff = 'Bootstrap' in methodName and kEffValues.size > 0 and np.any(~np.isnan(kEffValues))
-
-        kEffMean = np.nanmean(kEffValues) if hasKeff else np.nan
-        kEffCI = np.nanpercentile(kEffValues, [2.5, 97.5]) if hasKeff else np.array([np.nan, np.nan])
-
-        summary[methodName] = {
-            'fwer_mean': np.mean(results[methodName]['fwer']),
-            'fdr_mean': np.mean(results[methodName]['fdr']),
-            'power_mean': np.nanmean(results[methodName]['power']),
-            'kEff_mean': kEffMean,
-            'fwer_ci': np.percentile(results[methodName]['fwer'], [2.5, 97.5]),
-            'fdr_ci': np.percentile(results[methodName]['fdr'], [2.5, 97.5]),
-            'power_ci': np.nanpercentile(results[methodName]['power'], [2.5, 97.5]),
-            'kEff_ci': kEffCI
-        }
+    for methodName, metrics in accumulators.items():
+        # classical methods never update kEff, so its mean and CI stay NaN
+        summary[methodName] = summarizePerformance(metrics)
+        summary[methodName]['kEff_mean'] = metrics['kEff'].finalMean()
+        summary[methodName]['kEff_ci'] = metrics['kEff'].quantile([2.5, 97.5])
+        summary[methodName]['bootstrapReps_mean'] = metrics['bootstrapReps'].finalMean()
 
         if methodName == 'Bootstrap-Single':
-            summary[methodName]['tStar_mean'] = np.mean(results[methodName]['tStars'])
-            summary[methodName]['tStar_std'] = np.std(results[methodName]['tStars'])
+            summary[methodName]['tStar_mean'] = metrics['tStar'].finalMean()
+            summary[methodName]['tStar_std'] = metrics['tStar'].std()
 
     return summary
 
-def _run_bootstrap_scenario(args):
-    phi, rho, varied_param = args
-    summary = monteCarloWithBootstrap(phi=phi, rho=rho)
+def bootstrapPrecision(accumulators):
+    """Largest FWER or FDR standard error over the methods."""
+    return np.nanmax([
+        [metrics['fwer'].standardError(), metrics['fdr'].standardError()] for metrics in accumulators.values()
+    ])
+
+def monteCarloWithBootstrap(phi, rho, alpha=ALPHA, numReps=NUMBERREPS, numberBootstrap=NUMBERBOOTSTRAP, blockLength=None,
+                            seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS, targetSE=None, timeBudget=None,
+                            sequentialBootstrap=SEQUENTIAL_BOOTSTRAP):
+    # with targetSE or timeBudget (seconds) numReps is replaced by adaptive stopping
+    kwargs = {
+        'alpha': alpha, 'numberBootstrap': numberBootstrap, 'blockLength': blockLength,
+        'seed': seed, 'commonRandomNumbers': commonRandomNumbers, 'sequentialBootstrap': sequentialBootstrap
+    }
+    if targetSE is None and timeBudget is None:
+        accumulators = cachedAccumulate(accumulateWithBootstrap, phi, rho, numReps, kwargs)
+    else:
+        accumulators, numReps = accumulateAdaptively(
+            accumulateWithBootstrap, phi, rho, kwargs, bootstrapPrecision, targetSE, timeBudget
+        )
+
+    return summarizeWithBootstrap(accumulators)
 
+def _annotateScenario(summary, phi, rho, varied_param):
     for method in summary:
-        if varied_param == 'phi':
-            summary[method]['scenario'] = f'phi={phi}'
-            summary[method]['varied_param'] = 'phi'
-            summary[method]['phi'] = phi
-            summary[method]['rho'] = rho
-        else:  # varied_param == 'rho'
-            summary[method]['scenario'] = f'rho={rho}'
-            summary[method]['varied_param'] = 'rho'
-            summary[method]['phi'] = phi
-            summary[method]['rho'] = rho
+        summary[method]['scenario'] = f'{varied_param}={phi if varied_param == "phi" else rho}'
+        summary[method]['varied_param'] = varied_param
+        summary[method]['phi'] = phi
+        summary[method]['rho'] = rho
 
     return summary
 
-def runFullGridWithBootstrap():
+def monteCarloBandwidthSweep(phi, rho, bandwidths=HAC_BANDWIDTHS, alpha=ALPHA, numReps=NUMBERREPS, numberBootstrap=NUMBERBOOTSTRAP,
+                             blockLength=None, seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS):
+    accumulators = cachedAccumulate(accumulateBandwidthSweep, phi, rho, numReps, {
+        'bandwidths': list(bandwidths), 'alpha': alpha, 'numberBootstrap': numberBootstrap, 'blockLength': blockLength,
+        'seed': seed, 'commonRandomNumbers': commonRandomNumbers
+    })
+
+    return {lag: summarizeWithBootstrap(lagAccumulators) for lag, lagAccumulators in accumulators.items()}
+
+def runFullGridWithBootstrap(commonRandomNumbers=COMMON_RANDOM_NUMBERS, bandwidths=None):
+    """
+    Bootstrap grid over PHI_LEVELS and RHO_LEVELS.
+
+    With bandwidths, every grid point is run once for all HAC lags and the
+    Andrews lag, and {lag: allResults} is returned for a sensitivity sweep.
+    """
+    if bandwidths is not None:
+        sweeps = [
+            (monteCarloBandwidthSweep(phi, rho, bandwidths, commonRandomNumbers=commonRandomNumbers), phi, rho, variedParam)
+            for phi, rho, variedParam in gridScenarios()
+        ]
+        return {
+            lag: [_annotateScenario(sweep[lag], phi, rho, variedParam) for sweep, phi, rho, variedParam in sweeps]
+            for lag in list(bandwidths) + ['auto']
+        }
+
     allResults = []
 
     # row 0: varying phi
     for phi in PHI_LEVELS:
-        summary = monteCarloWithBootstrap(phi=phi, rho=BASERHO)
+        summary = monteCarloWithBootstrap(phi=phi, rho=BASERHO, commonRandomNumbers=commonRandomNumbers)
 
         for method in summary:
             summary[method]['scenario'] = f'phi={phi}'
@@ -293,7 +939,7 @@ def runFullGridWithBootstrap():
 
     # row 1: varying rho
     for rho in RHO_LEVELS:
-        summary = monteCarloWithBootstrap(phi=BASEPHI, rho=rho)
+        summary = monteCarloWithBootstrap(phi=BASEPHI, rho=rho, commonRandomNumbers=commonRandomNumbers)
 
         for method in summary:
             summary[method]['scenario'] = f'rho={rho}'
@@ -305,20 +951,24 @@ def runFullGridWithBootstrap():
 
     return allResults
 
-def runFullGridWithBootstrapParallel():
-    tasks = []
+def gridScenarios():
+    return [(phi, BASERHO, 'phi') for phi in PHI_LEVELS] + [(BASEPHI, rho, 'rho') for rho in RHO_LEVELS]
 
-    for phi in PHI_LEVELS:
-        tasks.append((phi, BASERHO, 'phi'))
-
-    for rho in RHO_LEVELS:
-        tasks.append((BASEPHI, rho, 'rho'))
-
-    with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
-        results = list(executor.map(_run_bootstrap_scenario, tasks))
+def runFullGridWithBootstrapParallel(commonRandomNumbers=COMMON_RANDOM_NUMBERS, maxWorkers=None, numReps=NUMBERREPS,
+                                     checkpointDir=None, resume=False):
+    # every grid point is split into replicate chunks sharing one pool of all cores
+    workUnits = {
+        (phi, rho, varied_param): (accumulateWithBootstrap, phi, rho, numReps, {'commonRandomNumbers': commonRandomNumbers})
+        for phi, rho, varied_param in sorted(gridScenarios(), key=lambda scenario: -scenario[0])
+    }
+    merged = runChunkedWorkUnits(workUnits, maxWorkers=maxWorkers, checkpointDir=checkpointDir, resume=resume)
 
-    return results
+    return [
+        _annotateScenario(summarizeWithBootstrap(merged[scenario]), *scenario)
+        for scenario in gridScenarios()
+    ]
 
+# CI columns are histogram percentiles, as in createSummaryTable
 def createSummaryTableWithBootstrap(allResults, savePath=None):
     rows = []
     for scenarioResults in allResults:
@@ -336,14 +986,19 @@ def createSummaryTableWithBootstrap(allResults, savePath=None):
                 'FDR_CI': f"[{stats['fdr_ci'][0]:.1%}, {stats['fdr_ci'][1]:.1%}]",
                 'Power': f"{stats['power_mean']:.1%}",
                 'Power_CI': f"[{stats['power_ci'][0]:.1%}, {stats['power_ci'][1]:.1%}]",
+                'FWER_SE': f"{stats['fwer_se']:.3f}",
+                'FDR_SE': f"{stats['fdr_se']:.3f}",
+                'Reps': stats['numReps'],
             }
 
             if 'Bootstrap' in method:
                 row['Keff'] = f"{stats['kEff_mean']:.2f}"
                 row['Keff_CI'] = f"[{stats['kEff_ci'][0]:.2f}, {stats['kEff_ci'][1]:.2f}]"
+                row['Boot_Reps'] = f"{stats['bootstrapReps_mean']:.1f}"
             else:
                 row['Keff'] = '-'
                 row['Keff_CI'] = '-'
+                row['Boot_Reps'] = '-'
 
             if method == 'Bootstrap-Single':
                 row['Avg_tStar'] = f"{stats['tStar_mean']:.2f}"
@@ -6,82 +6,164 @@ from generateSyntheticData import *
 from plots import plotCalibrationCurves
 from constants import (
     TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH,
-    ALPHALEVELS, NUMBERREPS, NUMBERBOOTSTRAP, computeBlockLength
+    ALPHALEVELS, NUMBERREPS, NUMBERBOOTSTRAP, computeBlockLength, SEED, COMMON_RANDOM_NUMBERS,
+    CALIBRATION_ALPHA_GRID
 )
+from random_streams import replicateGenerator
+from functools import partial
+from scheduler import runChunkedWorkUnits, accumulateAdaptively
+from accumulators import replicateCount
+from result_cache import cachedAccumulate
+
+def rejectionsOverAlphaGrid(bootstrapNull, alphaGrid):
+    """
+    Rejection masks of every method at every alpha of the grid for one dataset.
+
+    Returns {method: (A, K) bool array}, using the same decision rules as the
+    single-alpha procedures so any grid point reproduces them exactly.
+    """
+    tStats, df = bootstrapNull['tStats'], bootstrapNull['df']
+    absTStats = np.abs(tStats)
+
+    tStars = np.percentile(bootstrapNull['maxStats'], 100 * (1 - alphaGrid))
+
+    return {
+        'Bonferroni': bonferroniBatchTStats(tStats, alphaGrid, df)[:, 0],
+        'Holm': holmBatchTStats(tStats, alphaGrid, df)[:, 0],
+        'BH': benjaminiHochbergBatchTStats(tStats, alphaGrid, df)[:, 0],
+        'Bootstrap-Single': absTStats[None, :] > tStars[:, None],
+        'Bootstrap-RomanoWolf': bootstrapNull['rwPAdj'][None, :] < alphaGrid[:, None]
+    }
 
-def runCalibrationCurveExperiment(phi, rho, alphaLevels=ALPHALEVELS, numReps=NUMBERREPS, numberBootstrap=NUMBERBOOTSTRAP, blockLength=None):
-    if blockLength is None:
-        blockLength = computeBlockLength(phi)
-        print(f"Using block length = {blockLength} (computed from phi={phi})")
+def calibrationReplicateRecord(bootstrapNull, isTrue, alphaGrid):
+    """
+    Error profile of one replicate over the whole alpha grid.
 
-    methods = {
-        'Bonferroni': bonferroni,
-        'Holm': holm,
-        'BH': benjaminiHochberg,
-        'Bootstrap-Single': None,
-        'Bootstrap-RomanoWolf': None
-    }
+    For every method records the smallest grid alpha at which it makes a false
+    rejection (inf if it never does) and the total, false and true discovery
+    counts at every grid alpha.
+    """
+    record = {}
 
-    allResults = {}
+    for methodName, rejected in rejectionsOverAlphaGrid(bootstrapNull, alphaGrid).items():
+        falseDiscoveries = np.sum(rejected & ~isTrue, axis=1)
+        hasFalse = falseDiscoveries > 0
 
-    for alpha in alphaLevels:
-        print(f"calibration for alpha = {alpha:.3f}...")
+        record[methodName] = {
+            'criticalAlpha': alphaGrid[np.argmax(hasFalse)] if np.any(hasFalse) else np.inf,
+            'discoveries': np.sum(rejected, axis=1),
+            'falseDiscoveries': falseDiscoveries,
+            'trueDiscoveries': np.sum(rejected & isTrue, axis=1)
+        }
 
-        results = {method: {'fwer': [], 'fdr': [], 'power': []} for method in methods}
+    return record
 
-        for rep in range(numReps):
-            data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
-                TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho
-            )
-            tStats, pVals = computeTestStatistics(data)
+CALIBRATION_METHODS = ['Bonferroni', 'Holm', 'BH', 'Bootstrap-Single', 'Bootstrap-RomanoWolf']
 
-            # classical methods
-            for methodName, methodFunc in methods.items():
-                if 'Bootstrap' in methodName:
-                    continue
+def calibrationAlphaGrid(alphaLevels=ALPHALEVELS, alphaGrid=CALIBRATION_ALPHA_GRID):
+    return np.unique(np.round(np.concatenate([np.asarray(alphaGrid, dtype=float), alphaLevels]), 6))
 
-                rejected = methodFunc(pVals, alpha)
-                performance = measurePerformance(rejected, isTrue)
+def accumulateCalibration(phi, rho, replicates, alphaGrid, numberBootstrap=NUMBERBOOTSTRAP, blockLength=None,
+                          seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS):
+    """Run the replicates in a range and return per-method accumulators over the alpha grid."""
+    if blockLength is None:
+        blockLength = computeBlockLength(phi)
 
-                results[methodName]['fwer'].append(performance['fwer'])
-                results[methodName]['fdr'].append(performance['fdr'])
-                results[methodName]['power'].append(performance['power'])
+    accumulators = {method: newPerformanceAccumulators((len(alphaGrid),)) for method in CALIBRATION_METHODS}
 
-            # bootstrap single
-            performanceBoot, _, _ = applyBootstrapCalibration(
-                data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap
-            )
-            results['Bootstrap-Single']['fwer'].append(performanceBoot['fwer'])
-            results['Bootstrap-Single']['fdr'].append(performanceBoot['fdr'])
-            results['Bootstrap-Single']['power'].append(performanceBoot['power'])
+    for rep in replicates:
+        dataRng = replicateGenerator(phi, rho, rep, 'data', seed, commonRandomNumbers)
+        bootstrapRng = replicateGenerator(phi, rho, rep, 'bootstrap', seed, commonRandomNumbers)
+
+        data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
+            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho, dataRng
+        )
+        bootstrapNull = computeBootstrapNull(data, clusterLabels, blockLength, numberBootstrap, rng=bootstrapRng)
+        record = calibrationReplicateRecord(bootstrapNull, isTrue, alphaGrid)
 
-            # bootstrap RomanoWolf
-            performanceRW, _, _ = applyRomanoWolfBootstrapCalibration(
-                data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap
+        for methodName in CALIBRATION_METHODS:
+            counts = record[methodName]
+            accumulators[methodName]['fwer'].update(counts['criticalAlpha'] <= alphaGrid)
+            accumulators[methodName]['fdr'].update(counts['falseDiscoveries'] / np.maximum(counts['discoveries'], 1))
+            accumulators[methodName]['power'].update(
+                counts['trueDiscoveries'] / np.sum(isTrue) if np.any(isTrue) else np.full(len(alphaGrid), np.nan)
             )
-            results['Bootstrap-RomanoWolf']['fwer'].append(performanceRW['fwer'])
-            results['Bootstrap-RomanoWolf']['fdr'].append(performanceRW['fdr'])
-            results['Bootstrap-RomanoWolf']['power'].append(performanceRW['power'])
-
-        summary = {}
-        for methodName in methods:
-            summary[methodName] = {
-                'fwer_mean': np.mean(results[methodName]['fwer']),
-                'fdr_mean': np.mean(results[methodName]['fdr']),
-                'power_mean': np.nanmean(results[methodName]['power']),
-                'fwer_se': np.std(results[methodName]['fwer']) / np.sqrt(numReps),
-                'fdr_se': np.std(results[methodName]['fdr']) / np.sqrt(numReps)
-            }
 
-        allResults[alpha] = summary
+    return accumulators
+
+def calibrationPrecision(accumulators, alphaIndices):
+    """Largest FWER or FDR standard error over the methods at the reported alpha levels."""
+    return np.nanmax([
+        [metrics['fwer'].standardError()[alphaIndices], metrics['fdr'].standardError()[alphaIndices]]
+        for metrics in accumulators.values()
+    ])
+
+def summarizeCalibration(accumulators, alphaGrid):
+    allResults = {float(alpha): {} for alpha in alphaGrid}
+    numReps = replicateCount(accumulators)
+
+    for methodName, metrics in accumulators.items():
+        fwerMean, fdrMean, powerMean = metrics['fwer'].finalMean(), metrics['fdr'].finalMean(), metrics['power'].finalMean()
+        fwerSE, fdrSE = metrics['fwer'].standardError(), metrics['fdr'].standardError()
+
+        for i, alpha in enumerate(alphaGrid):
+            allResults[float(alpha)][methodName] = {
+                'fwer_mean': fwerMean[i],
+                'fdr_mean': fdrMean[i],
+                'power_mean': powerMean[i],
+                'fwer_se': fwerSE[i],
+                'fdr_se': fdrSE[i],
+                'numReps': numReps
+            }
 
     return allResults
 
+def runCalibrationCurveExperiment(phi, rho, alphaLevels=ALPHALEVELS, numReps=NUMBERREPS, numberBootstrap=NUMBERBOOTSTRAP, blockLength=None,
+                                  seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS, alphaGrid=CALIBRATION_ALPHA_GRID,
+                                  targetSE=None, timeBudget=None):
+    """
+    FWER/FDR/power calibration curves from a single simulation pass.
+
+    Every replicate is simulated and bootstrapped once and evaluated on the union
+    of alphaGrid and alphaLevels. FWER(alpha) is the fraction of replicates whose
+    critical alpha is already reached. Returns {alpha: {method: summary}} for
+    every alpha on that grid.
 
-def createCalibrationTable(calibrationResults, savePath=None):
+    With targetSE or timeBudget (seconds), replicates run in batches until the
+    FWER/FDR standard errors at alphaLevels reach targetSE or time runs out.
+    """
+    if blockLength is None:
+        blockLength = computeBlockLength(phi)
+        print(f"Using block length = {blockLength} (computed from phi={phi})")
+
+    alphaGrid = calibrationAlphaGrid(alphaLevels, alphaGrid)
+    print(f"calibration over {len(alphaGrid)} alpha levels in [{alphaGrid[0]:.4f}, {alphaGrid[-1]:.4f}]...")
+
+    kwargs = {
+        'alphaGrid': alphaGrid, 'numberBootstrap': numberBootstrap, 'blockLength': blockLength,
+        'seed': seed, 'commonRandomNumbers': commonRandomNumbers
+    }
+    if targetSE is None and timeBudget is None:
+        accumulators = cachedAccumulate(accumulateCalibration, phi, rho, numReps, kwargs)
+    else:
+        alphaIndices = np.flatnonzero(np.isin(alphaGrid, np.round(alphaLevels, 6)))
+        accumulators, numReps = accumulateAdaptively(
+            accumulateCalibration, phi, rho, kwargs, partial(calibrationPrecision, alphaIndices=alphaIndices),
+            targetSE, timeBudget
+        )
+        print(f"stopped after {numReps} replicates")
+
+    return summarizeCalibration(accumulators, alphaGrid)
+
+
+def createCalibrationTable(calibrationResults, savePath=None, alphaLevels=None):
     rows = []
 
-    for alpha in sorted(calibrationResults.keys()):
+    if alphaLevels is None:
+        alphaLevels = calibrationResults.keys()
+    alphaLevels = [alpha for alpha in sorted(calibrationResults.keys()) if np.any(np.isclose(alpha, list(alphaLevels)))]
+
+    for alpha in alphaLevels:
         for method, stats in calibrationResults[alpha].items():
             row = {
                 'Method': method,
@@ -91,7 +173,8 @@ def createCalibrationTable(calibrationResults, savePath=None):
                 'Realized_FDR': f"{stats['fdr_mean']:.3f}",
                 'FDR_SE': f"{stats['fdr_se']:.3f}",
                 'Power': f"{stats['power_mean']:.3f}",
-                'Calibration_Error': f"{abs(stats['fwer_mean'] - alpha):.3f}"
+                'Calibration_Error': f"{abs(stats['fwer_mean'] - alpha):.3f}",
+                'Reps': stats['numReps']
             }
             rows.append(row)
 
@@ -101,4 +184,16 @@ def createCalibrationTable(calibrationResults, savePath=None):
         dataframe.to_csv(savePath, index=False)
         print(f"Table saved: {savePath}")
 
-    return dataframe
\ No newline at end of file
+    return dataframe
+
+def runCalibrationScenariosParallel(scenarios, alphaLevels=ALPHALEVELS, numReps=NUMBERREPS, maxWorkers=None,
+                                    checkpointDir=None, resume=False):
+    """Calibration results for (phi, rho, ...) scenarios, run as replicate chunks on all cores."""
+    alphaGrid = calibrationAlphaGrid(alphaLevels)
+    workUnits = {
+        (phi, rho): (accumulateCalibration, phi, rho, numReps, {'alphaGrid': alphaGrid})
+        for phi, rho, *_ in scenarios
+    }
+    merged = runChunkedWorkUnits(workUnits, maxWorkers=maxWorkers, checkpointDir=checkpointDir, resume=resume)
+
+    return [summarizeCalibration(merged[(phi, rho)], alphaGrid) for phi, rho, *_ in scenarios]
@@ -8,15 +8,54 @@ import numpy as np
 
 # Experiment parameters
 ALPHA = 0.05
-ALPHALEVELS = [0.01, 0.025, 0.05]  # for calibration curves and stability (reduced for efficiency)
+ALPHALEVELS = [0.01, 0.025, 0.05]  # for calibration tables and stability
+CALIBRATION_ALPHA_GRID = np.round(np.linspace(0.0025, 0.10, 40), 4)  # dense grid for calibration curves
 NUMBERREPS = 500
 NUMBERREPS_STABILITY = 250  # fewer reps for stability
+PRECISION = 'float64'  # 'float32' halves panel, gather and HAC traffic; means and variances are combined in float64
+KERNEL_BACKEND = 'numpy'  # 'numba' uses the compiled kernels when numba is installed
+HAC_MAX_LAG = 6  # Newey-West lag of every reported t-stat
+HAC_BANDWIDTHS = [2, 4, 6, 10, 16]  # Newey-West lags of the bandwidth-sensitivity sweep
+HAC_MAX_AUTO_LAG = 50  # cap on the Andrews plug-in lag
+HAC_FFT_MIN_LAG = 16  # autocovariances by FFT from this many lags on
+ONLINE_HAC_REFRESH = 1000  # streaming HAC sums are rebuilt from the window after this many updates
+PANEL_BATCH_SIZE = 50  # replicate panels generated per batch
+REPLICATE_CHUNK_SIZE = 10  # replicates per scheduled work chunk
+ADAPTIVE_BATCH_SIZE = 50  # replicates per batch when stopping on a target SE or time budget
+ADAPTIVE_MIN_REPS = 100  # never stop before this many, SEs of rare events are unreliable below
+ADAPTIVE_MAX_REPS = 5000
+CHECKPOINT_DIR = "checkpoints"  # per-chunk accumulator checkpoints for resume/extend
+
+# Result cache
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_DIR = "cache"  # scenario accumulators keyed by a hash of their configuration
+RESULT_CACHE_MAX_BYTES = 1024**3  # evict once the cache grows beyond this
+RESULT_CACHE_EVICTION = 'lru'  # 'lru' (least recently used), 'fifo' (oldest written) or 'none'
+
+# Random streams
+SEED = 73
+COMMON_RANDOM_NUMBERS = False  # share innovations across phi/rho sweep levels
 
 # Bootstrap parameters
 NUMBERBOOTSTRAP = 300
 NUMBERBOOTSTRAP_STABILITY = 150  # reduced for stability
+JOINT_STABILITY_RESAMPLING = False  # stability null and survivor resamples share one plan and its HAC denominators
 MIN_BLOCKLENGTH = 2  # minimum block length to avoid degenerate cases
 MAX_BLOCKLENGTH = 50  # maximum to avoid extremely long blocks
+BOOTSTRAP_SCHEME = 'gather'  # 'gather' rebuilds replicates; 'blockStatistics' assembles them from block tables
+                             # (faster only when blockLength exceeds HAC_MAX_LAG, slower at the default of 2);
+                             # 'factorized' computes t-stats per time resample and gathers them by cluster draw;
+                             # 'multiplier' weights periods and clusters by dependent wild multipliers instead of resampling them
+CLUSTER_DRAWS_PER_TIME_RESAMPLE = 1  # replicates sharing one time resample, with independent cluster draws; the
+                                     # factorized scheme and real panels only save HAC work when this exceeds 1
+BOOTSTRAP_MEMORY_BUDGET = 64 * 1024**2  # bytes of gathered bootstrap replicates held at once
+SEQUENTIAL_BOOTSTRAP = False  # stop drawing replicates once every decision at alpha is settled
+SEQUENTIAL_BOOTSTRAP_BATCH = 25  # replicates drawn between stopping checks
+SEQUENTIAL_BOOTSTRAP_CONFIDENCE = 0.95  # Clopper-Pearson level for settling a rejection before its h-th exceedance
+SEQUENTIAL_BOOTSTRAP_EXCEEDANCES = 5  # Besag-Clifford h: a decision is settled at its h-th exceedance
+OUT_OF_CORE_COLUMN_BLOCK = 1024  # signals read from disk at a time for real panels
+HISTOGRAM_BINS = 2000  # resolution of the streaming quantile histograms
+TSTAR_HISTOGRAM_MAX = 20.0  # upper edge of the bootstrap threshold histogram
 
 # Data generation parameters
 TIME = 250
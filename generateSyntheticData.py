@@ -1,64 +1,70 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.signal import lfilter
 from constants import (
     TIME, PERIOD, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH,
-    BASEPHI, BASERHO, PHI_LEVELS, RHO_LEVELS
+    BASEPHI, BASERHO, PHI_LEVELS, RHO_LEVELS, PRECISION
 )
+from random_streams import replicateGenerator
 
-#np.random.seed(73)
+# AR(1) recursion x[t] = phi * x[t-1] + e[t] as a linear filter over pre-drawn innovations
+def ar1Filter(innovations, phi, axis=0):
+    return lfilter([1.0], [1.0, -phi], innovations, axis=axis)
 
 # generate one independent AR1 series
-def generateTimeDependentSeries(time, phi):
-    x = np.zeros(time)
-    x[0] = np.random.randn()
-
-    for t in range(1, time):
-        x[t] = phi * x[t-1] + np.random.randn()
-
-    return x
+def generateTimeDependentSeries(time, phi, rng=None):
+    rng = np.random if rng is None else rng
+    return ar1Filter(rng.standard_normal(time), phi)
+
+def generatePanelBatch(numberReplicates, time, numberClusters, firmsPerCluster, numberTrue, strength, phi, rho, rng=None,
+                       dtype=PRECISION):
+    """
+    Generate many clustered panels with planted signals as one (R, T, K) array.
+
+    Replicates follow the same model as generateClusteredPanelWithPlantedSignals:
+    AR(1) cluster factors and firm shocks mixed with weight rho, and the first
+    numberTrue firms of every cluster shifted by strength. Cluster labels and
+    the true-signal mask are shared by all replicates.
+
+    rng is a numpy Generator, or a list with one Generator per replicate so that
+    each panel comes from its own reproducible stream. Defaults to np.random.
+    Panels are simulated in float64 and returned as dtype.
+    """
+    if numberTrue >= firmsPerCluster:
+        raise ValueError(f"numberTrue ({numberTrue}) must be less than firmsPerCluster ({firmsPerCluster})")
 
-# multiple industries
-def generateClusteredPanelWithTimeDependence(time, numberClusters, firmsPerCluster, phi, rho):
     totalFirms = numberClusters * firmsPerCluster
-    data = np.zeros((time, totalFirms))
-
-    clusterFactors = []
-    for _ in range(numberClusters):
-        factor = generateTimeDependentSeries(time, phi)
-        clusterFactors.append(factor)
+    clusterLabels = np.repeat(np.arange(numberClusters), firmsPerCluster)
+    isTrue = np.arange(totalFirms) % firmsPerCluster < numberTrue
 
-    clusterLabels = []
-    firmIdx = 0
+    if isinstance(rng, (list, tuple)):
+        innovations = np.stack([r.standard_normal((time, numberClusters + totalFirms)) for r in rng])
+    else:
+        rng = np.random if rng is None else rng
+        innovations = rng.standard_normal((numberReplicates, time, numberClusters + totalFirms))
 
-    for clusterIdx in range(numberClusters):
-        for _ in range(firmsPerCluster):
-            epsilon = generateTimeDependentSeries(time, phi)
-            data[:, firmIdx] = (np.sqrt(rho) * clusterFactors[clusterIdx] + np.sqrt(1 - rho) * epsilon)
-            clusterLabels.append(clusterIdx)
-            firmIdx += 1
+    innovations = ar1Filter(innovations, phi, axis=1)
+    clusterFactors = innovations[:, :, :numberClusters]
+    epsilon = innovations[:, :, numberClusters:]
 
-    clusterLabels = np.array(clusterLabels)
+    data = np.sqrt(rho) * clusterFactors[:, :, clusterLabels] + np.sqrt(1 - rho) * epsilon
+    data[:, :, isTrue] += strength
 
-    return data, clusterLabels
+    return data.astype(dtype, copy=False), clusterLabels, isTrue
 
-def generateClusteredPanelWithPlantedSignals(time, numberClusters, firmsPerCluster, numberTrue, strength, phi, rho):
-    if numberTrue >= firmsPerCluster:
-        raise ValueError(f"numberTrue ({numberTrue}) must be less than firmsPerCluster ({firmsPerCluster})")
-
-    data, clusterLabels = generateClusteredPanelWithTimeDependence(time, numberClusters, firmsPerCluster, phi, rho)
-
-    totalFirms = numberClusters * firmsPerCluster
-    isTrue = np.zeros(totalFirms, dtype=bool)
+# multiple industries
+def generateClusteredPanelWithTimeDependence(time, numberClusters, firmsPerCluster, phi, rho, rng=None, dtype=PRECISION):
+    data, clusterLabels, _ = generatePanelBatch(1, time, numberClusters, firmsPerCluster, 0, 0.0, phi, rho, rng, dtype)
 
-    for clusterIdx in range(numberClusters):
-        clusterFirmIndices = np.where(clusterLabels == clusterIdx)[0]
+    return data[0], clusterLabels
 
-        for i in range(numberTrue):
-            firmIdx = clusterFirmIndices[i]
-            data[:, firmIdx] += strength
-            isTrue[firmIdx] = True
+def generateClusteredPanelWithPlantedSignals(time, numberClusters, firmsPerCluster, numberTrue, strength, phi, rho, rng=None,
+                                             dtype=PRECISION):
+    data, clusterLabels, isTrue = generatePanelBatch(
+        1, time, numberClusters, firmsPerCluster, numberTrue, strength, phi, rho, rng, dtype
+    )
 
-    return data, clusterLabels, isTrue
+    return data[0], clusterLabels, isTrue
 
 def generateClusteredDatasets():
     datasets = []
@@ -66,7 +72,8 @@ def generateClusteredDatasets():
     phiRow = []
     for phi in PHI_LEVELS:
         data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
-            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, BASERHO
+            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, BASERHO,
+            rng=replicateGenerator(phi, BASERHO, 0, 'data')
         )
         phiRow.append((data, clusterLabels, isTrue))
     datasets.append(phiRow)
@@ -74,7 +81,8 @@ def generateClusteredDatasets():
     rhoRow = []
     for rho in RHO_LEVELS:
         data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
-            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, BASEPHI, rho
+            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, BASEPHI, rho,
+            rng=replicateGenerator(BASEPHI, rho, 0, 'data')
         )
         rhoRow.append((data, clusterLabels, isTrue))
     datasets.append(rhoRow)
@@ -0,0 +1,127 @@
+"""
+Optional Numba-compiled kernels for the bootstrap hot paths.
+
+The compiled backend fuses the block/cluster index gather, centering,
+autocovariances and the Bartlett sum per bootstrap column, so replicates are
+never materialized, and runs the Romano-Wolf max-over-remaining scan per
+replicate. Loops over replicates run in parallel with the GIL released.
+Without Numba installed the NumPy path is always used.
+"""
+
+import numpy as np
+from constants import KERNEL_BACKEND
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    _jit = numba.njit(parallel=True, nogil=True, cache=True)
+    # helpers called inside prange loops must not open parallel regions of their own
+    _serialJit = numba.njit(nogil=True, cache=True)
+    prange = numba.prange
+else:
+    # plain Python stand-ins keep the kernels importable
+    _jit = _serialJit = lambda function: function
+    prange = range
+
+_backend = KERNEL_BACKEND
+
+def setKernelBackend(backend):
+    global _backend
+    if backend not in ('numpy', 'numba'):
+        raise ValueError(f"unknown kernel backend: {backend}")
+    _backend = backend
+
+def activeKernelBackend():
+    """The backend kernels actually run on: 'numba' only when it is selected and installed."""
+    return 'numba' if useNumba() else 'numpy'
+
+def useNumba():
+    return _backend == 'numba' and numba is not None
+
+def configureWorker(backend, threads):
+    """
+    Pool initializer: apply the parent's backend, which spawned workers would
+    otherwise read from constants, and give each worker's parallel kernels its
+    share of the cores instead of all of them.
+    """
+    setKernelBackend(backend)
+    if numba is not None:
+        numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+
+@_serialJit
+def _hacColumn(values, maxLag):
+    T = values.shape[0]
+    mean = 0.0
+    for t in range(T):
+        mean += values[t]
+    mean /= T
+
+    variance = 0.0
+    for t in range(T):
+        variance += (values[t] - mean) ** 2
+    variance /= T
+
+    for lag in range(1, min(maxLag, T - 1) + 1):
+        covariance = 0.0
+        for t in range(lag, T):
+            covariance += (values[t] - mean) * (values[t - lag] - mean)
+        variance += 2.0 * (1.0 - lag / (maxLag + 1.0)) * covariance / T
+
+    se = np.sqrt(variance / T)
+    return np.nan if se == 0 else mean / se
+
+@_jit
+def hacTStatsKernel(data, maxLag):
+    """HAC t-stats of every column of a (T, K) panel; matches hacTStats."""
+    T, K = data.shape
+    tStats = np.empty(K)
+    for k in prange(K):
+        tStats[k] = _hacColumn(data[:, k].astype(np.float64), maxLag)
+
+    return tStats
+
+@_jit
+def gatheredHacTStatsKernel(data, timeIndices, columnIndices, maxLag):
+    """
+    HAC t-stats of bootstrap replicates straight from their index plans.
+
+    Column j of replicate b is data[timeIndices[b], columnIndices[b, j]], as in
+    iterBootstrapChunks, but only one gathered series per thread is ever held.
+    """
+    numberBootstrap, T = timeIndices.shape
+    K = columnIndices.shape[1]
+    tStats = np.empty((numberBootstrap, K))
+
+    for b in prange(numberBootstrap):
+        values = np.empty(T)
+        for j in range(K):
+            column = columnIndices[b, j]
+            for t in range(T):
+                values[t] = data[timeIndices[b, t], column]
+            tStats[b, j] = _hacColumn(values, maxLag)
+
+    return tStats
+
+@_jit
+def romanoWolfExceedanceKernel(sortedStats, sortedBoot):
+    """Per-step exceedance counts of the Romano-Wolf step-down; matches romanoWolfExceedanceCounts."""
+    numberBootstrap, K = sortedBoot.shape
+    exceeds = np.zeros((numberBootstrap, K), dtype=np.uint8)
+
+    for b in prange(numberBootstrap):
+        runningMax = -np.inf
+        for j in range(K - 1, -1, -1):
+            runningMax = max(runningMax, sortedBoot[b, j])
+            if runningMax >= sortedStats[j]:
+                exceeds[b, j] = 1
+
+    # column sums in a second parallel pass, so no two threads write the same count
+    counts = np.zeros(K, dtype=np.int64)
+    for j in prange(K):
+        for b in range(numberBootstrap):
+            counts[j] += exceeds[b, j]
+
+    return counts
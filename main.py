@@ -1,35 +1,38 @@
 import sys
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from generateSyntheticData import *
 from baseline import *
 from bootstrap import *
 from calibration_curves import *
 from stability_analysis import *
 from plots import *
-from constants import SCENARIOS
+from real_panel import runRealPanelCalibration
+from precision_validation import runPrecisionValidation, runKernelValidation
+from constants import SCENARIOS, ALPHALEVELS, NUMBERREPS, NUMBERREPS_STABILITY, CHECKPOINT_DIR, HAC_BANDWIDTHS
 
-# helper functions for parallel execution
-def _run_calibration_scenario(args):
-    idx, phi, rho, description, scenario_name = args
-    print(f"[Calibration {idx}] Starting: {description} (phi={phi}, rho={rho})")
+SCENARIO_NAMES = ['worstcase', 'highphi', 'highrho', 'baseline']
 
-    results = runCalibrationCurveExperiment(phi=phi, rho=rho)
-    createCalibrationTable(results, savePath=f"results/calibration_{scenario_name}.csv")
-    plotCalibrationCurves(results, savePath=f"plots/calibration_{scenario_name}.png")
-    print(f"[Calibration {idx}] Complete: {scenario_name}")
+# calibration and stability scenarios run as replicate chunks on all cores
+def _run_calibration_scenarios(numReps=NUMBERREPS, resume=False):
+    for idx, (phi, rho, description) in enumerate(SCENARIOS, 1):
+        print(f"[Calibration {idx}] Starting: {description} (phi={phi}, rho={rho})")
+
+    allResults = runCalibrationScenariosParallel(SCENARIOS, numReps=numReps, checkpointDir=CHECKPOINT_DIR, resume=resume)
 
-    return scenario_name
+    for scenario_name, results in zip(SCENARIO_NAMES, allResults):
+        createCalibrationTable(results, savePath=f"results/calibration_{scenario_name}.csv", alphaLevels=ALPHALEVELS)
+        plotCalibrationCurves(results, savePath=f"plots/calibration_{scenario_name}.png")
+        print(f"[Calibration] Complete: {scenario_name}")
 
-def _run_stability_scenario(args):
-    idx, phi, rho, description, scenario_name = args
-    print(f"[Stability {idx}] Starting: {description} (phi={phi}, rho={rho})")
+def _run_stability_scenarios(numReps=NUMBERREPS_STABILITY, resume=False):
+    for idx, (phi, rho, description) in enumerate(SCENARIOS, 1):
+        print(f"[Stability {idx}] Starting: {description} (phi={phi}, rho={rho})")
 
-    results = runStabilityExperiment(phi=phi, rho=rho)
-    createStabilityTable(results, savePath=f"results/stability_{scenario_name}.csv")
-    print(f"[Stability {idx}] Complete: {scenario_name}")
+    allResults = runStabilityScenariosParallel(SCENARIOS, numReps=numReps, checkpointDir=CHECKPOINT_DIR, resume=resume)
 
-    return scenario_name
+    for scenario_name, results in zip(SCENARIO_NAMES, allResults):
+        createStabilityTable(results, savePath=f"results/stability_{scenario_name}.csv")
+        print(f"[Stability] Complete: {scenario_name}")
 
 def runGenerateData():
     clusteredDatasets = generateClusteredDatasets()
@@ -51,34 +54,37 @@ def runBootstrap():
     plotPowerVsDependenceWithBootstrap(allResultsBootstrap)
     plotFWERvsPowerWithBootstrap(allResultsBootstrap)
 
-def runCalibrationCurves():
-    scenario_names = ['worstcase', 'highphi', 'highrho', 'baseline']
+def runBandwidthSweep():
+    # one simulation pass per grid point covers every HAC lag
+    resultsByLag = runFullGridWithBootstrap(bandwidths=HAC_BANDWIDTHS)
+    for lag, allResults in resultsByLag.items():
+        createSummaryTableWithBootstrap(allResults, savePath=f"results/bootstrap_grid_summary_lag_{lag}.csv")
 
+def runCalibrationCurves():
     for idx, (phi, rho, description) in enumerate(SCENARIOS, 1):
         print(f"Scenario {idx}: {description} (phi={phi}, rho={rho})")
         results = runCalibrationCurveExperiment(phi=phi, rho=rho)
-        createCalibrationTable(results, savePath=f"results/calibration_{scenario_names[idx-1]}.csv")
+        createCalibrationTable(results, savePath=f"results/calibration_{SCENARIO_NAMES[idx-1]}.csv", alphaLevels=ALPHALEVELS)
         plotCalibrationCurves(results)
         print()
 
 def runStabilityAnalysis():
-    scenario_names = ['worstcase', 'highphi', 'highrho', 'baseline']
-
     for idx, (phi, rho, description) in enumerate(SCENARIOS, 1):
         print(f"Scenario {idx}: {description} (phi={phi}, rho={rho})")
         results = runStabilityExperiment(phi=phi, rho=rho)
-        createStabilityTable(results, savePath=f"results/stability_{scenario_names[idx-1]}.csv")
+        createStabilityTable(results, savePath=f"results/stability_{SCENARIO_NAMES[idx-1]}.csv")
         print()
 
-def runAll():
+def runAll(numReps=NUMBERREPS, numRepsStability=NUMBERREPS_STABILITY, resume=False):
+    # chunk checkpoints go to CHECKPOINT_DIR; resume reuses them, a fresh run discards them
     print("1/4: Generating synthetic data...")
     clusteredDatasets = generateClusteredDatasets()
     plotDatasets(clusteredDatasets, savePath="plots/synthetic_datasets.png")
     print()
 
     print("2/4: Running bootstrap grid analysis...")
-    print("(Testing 8 scenarios: 4 phi sweeps + 4 rho sweeps concurrently)")
-    allResultsBootstrap = runFullGridWithBootstrapParallel()
+    print("(Testing 8 scenarios: 4 phi sweeps + 4 rho sweeps as replicate chunks on all cores)")
+    allResultsBootstrap = runFullGridWithBootstrapParallel(numReps=numReps, checkpointDir=CHECKPOINT_DIR, resume=resume)
     createSummaryTableWithBootstrap(allResultsBootstrap, savePath="results/bootstrap_grid_summary.csv")
     print(f"Bootstrap grid analysis complete")
     print()
@@ -91,55 +97,50 @@ def runAll():
     print("3/4: Running calibration curve experiments...")
     print()
 
-    scenario_names = ['worstcase', 'highphi', 'highrho', 'baseline']
-    calibration_tasks = [
-        (idx, phi, rho, description, scenario_names[idx-1])
-        for idx, (phi, rho, description) in enumerate(SCENARIOS, 1)
-    ]
-
-    with ProcessPoolExecutor(max_workers=len(SCENARIOS)) as executor:
-        futures = [executor.submit(_run_calibration_scenario, task) for task in calibration_tasks]
-        for future in as_completed(futures):
-            scenario_name = future.result()
+    _run_calibration_scenarios(numReps, resume)
 
     print("4/4: Running stability analysis...")
     print()
 
-    stability_tasks = [
-        (idx, phi, rho, description, scenario_names[idx-1])
-        for idx, (phi, rho, description) in enumerate(SCENARIOS, 1)
-    ]
-
-    with ProcessPoolExecutor(max_workers=len(SCENARIOS)) as executor:
-        futures = [executor.submit(_run_stability_scenario, task) for task in stability_tasks]
-        for future in as_completed(futures):
-            scenario_name = future.result()
+    _run_stability_scenarios(numRepsStability, resume)
 
     print()
 
     print("PIPELINE COMPLETE")
 
+def runResume():
+    print("Resuming from checkpoints...")
+    runAll(resume=True)
+
+def runExtend(numReps):
+    # stability keeps its ratio to the main replicate count
+    numRepsStability = numReps * NUMBERREPS_STABILITY // NUMBERREPS
+    print(f"Extending checkpointed runs to {numReps} replicates ({numRepsStability} for stability)...")
+    runAll(numReps, numRepsStability, resume=True)
+
+def runPrecision():
+    print("Validating float32 against float64...")
+    print(runPrecisionValidation(savePath="results/precision_validation.csv").to_string(index=False))
+
+def runKernels():
+    print("Validating the Numba kernels against NumPy...")
+    print(runKernelValidation(savePath="results/kernel_validation.csv").to_string(index=False))
+
 def runStep4():
     print("Running stability analysis...")
 
-    scenario_names = ['worstcase', 'highphi', 'highrho', 'baseline']
-    stability_tasks = [
-        (idx, phi, rho, description, scenario_names[idx-1])
-        for idx, (phi, rho, description) in enumerate(SCENARIOS, 1)
-    ]
-
-    with ProcessPoolExecutor(max_workers=len(SCENARIOS)) as executor:
-        futures = [executor.submit(_run_stability_scenario, task) for task in stability_tasks]
-        for future in as_completed(futures):
-            scenario_name = future.result()
+    _run_stability_scenarios()
 
     print("PIPELINE COMPLETE")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
+    if len(sys.argv) < 2:
         sys.exit(1)
 
     command = sys.argv[1].lower()
+    allowedArgs = {"extend": (2, 3), "panel": (4, 5)}.get(command, (2,))
+    if len(sys.argv) not in allowedArgs:
+        sys.exit(1)
 
     if command == "data":
         runGenerateData()
@@ -147,12 +148,25 @@ if __name__ == "__main__":
         runBaseline()
     elif command == "bootstrap":
         runBootstrap()
+    elif command == "bandwidth":
+        runBandwidthSweep()
     elif command == "calibration":
         runCalibrationCurves()
     elif command == "stability":
         runStabilityAnalysis()
     elif command == "all":
         runAll()
+    elif command == "resume":
+        runResume()
+    elif command == "extend":
+        runExtend(int(sys.argv[2]) if len(sys.argv) == 3 else 2 * NUMBERREPS)
+    elif command == "panel":
+        # python main.py panel <panel.npy|.parquet> <labels.npy|.parquet> [outputDir]
+        runRealPanelCalibration(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) == 5 else "results/panel")
+    elif command == "precision":
+        runPrecision()
+    elif command == "kernels":
+        runKernels()
     elif command == "four":
         runStep4()
     else:
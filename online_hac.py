@@ -0,0 +1,127 @@
+"""
+Streaming Newey-West statistics for live signal monitoring.
+
+OnlineHACState keeps, per signal, the running sum and the lagged cross-products
+sum_t r_t * r_{t-l} for l = 0..maxLag over the current window. The centered
+autocovariances of hac_t_stat follow from these raw sums and the sums of the
+first and last l rows, so appending or dropping a row costs O(K * maxLag) and
+t-stats are available at any time without a pass over the history.
+
+The sums are taken around a fixed shift (the window mean at the last rebuild)
+so they do not cancel when the mean is large relative to the spread, and they
+are rebuilt from the window every ONLINE_HAC_REFRESH updates so rounding from
+adding and removing rows does not accumulate.
+"""
+
+from collections import deque
+import numpy as np
+from baseline import testStatisticsFromT
+from constants import HAC_MAX_LAG, ONLINE_HAC_REFRESH
+from bootstrap import drawBootstrapPlan, planSize, computeBootstrapNull
+
+class OnlineHACState:
+    def __init__(self, K, maxLag=HAC_MAX_LAG, window=None, refreshEvery=ONLINE_HAC_REFRESH):
+        self.K = K
+        self.maxLag = maxLag
+        self.window = window
+        self.refreshEvery = refreshEvery
+        self.rows = deque()
+        self.shift = None
+        self.updates = 0
+        self.total = np.zeros(K)
+        self.crossProducts = np.zeros((maxLag + 1, K))
+
+    @property
+    def time(self):
+        return len(self.rows)
+
+    def append(self, rows):
+        """Add one (K,) row or a (n, K) block of rows; the oldest rows leave a full rolling window."""
+        for row in np.atleast_2d(np.asarray(rows, dtype=float)):
+            if self.shift is None:
+                self.shift = row.copy()
+            shifted = row - self.shift
+            for lag in range(1, min(self.maxLag, self.time) + 1):
+                self.crossProducts[lag] += shifted * (self.rows[-lag] - self.shift)
+            self.crossProducts[0] += shifted * shifted
+            self.total += shifted
+            self.rows.append(row)
+            self._countUpdate()
+
+            if self.window is not None and self.time > self.window:
+                self.dropOldest()
+
+    def dropOldest(self, n=1):
+        """Drop the n oldest rows, or every row if fewer are held."""
+        for _ in range(min(n, self.time)):
+            oldest = self.rows[0] - self.shift
+            for lag in range(1, min(self.maxLag, self.time - 1) + 1):
+                self.crossProducts[lag] -= oldest * (self.rows[lag] - self.shift)
+            self.crossProducts[0] -= oldest * oldest
+            self.total -= oldest
+            self.rows.popleft()
+            self._countUpdate()
+
+    def _countUpdate(self):
+        self.updates += 1
+        if self.updates >= self.refreshEvery:
+            self.refresh()
+
+    def refresh(self):
+        """Rebuild the sums from the window around its current mean."""
+        self.updates = 0
+        self.total = np.zeros(self.K)
+        self.crossProducts = np.zeros((self.maxLag + 1, self.K))
+        if self.time == 0:
+            self.shift = None
+            return
+
+        panel = self.panel()
+        self.shift = panel.mean(axis=0)
+        shifted = panel - self.shift
+        self.total = shifted.sum(axis=0)
+        self.crossProducts[0] = np.sum(shifted * shifted, axis=0)
+        for lag in range(1, min(self.maxLag, self.time - 1) + 1):
+            self.crossProducts[lag] = np.sum(shifted[lag:] * shifted[:-lag], axis=0)
+
+    def panel(self):
+        return np.array(self.rows).reshape(self.time, self.K)
+
+    def hacTStats(self):
+        """Current HAC t-stats, equal to hacTStats(self.panel()) up to rounding."""
+        T = self.time
+        if T < 2:
+            return np.full(self.K, np.nan)
+
+        # moments of the shifted rows; the autocovariances do not depend on the shift
+        mean = self.total / T
+        varHat = self.crossProducts[0] / T - mean**2
+
+        headSum = np.zeros(self.K)
+        tailSum = np.zeros(self.K)
+        for lag in range(1, min(self.maxLag, T - 1) + 1):
+            headSum += self.rows[lag - 1] - self.shift
+            tailSum += self.rows[-lag] - self.shift
+            # sum_{t>=lag} (r_t - mean)(r_{t-lag} - mean) from the shifted sums
+            covariance = (self.crossProducts[lag] - mean * (2 * self.total - headSum - tailSum) + (T - lag) * mean**2) / T
+            varHat += 2.0 * (1.0 - lag / (self.maxLag + 1.0)) * covariance
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            se = np.sqrt(varHat / T)
+            return np.where(se == 0, np.nan, (self.shift + mean) / se)
+
+    def testStatistics(self, returnLogPValues=False):
+        return testStatisticsFromT(self.hacTStats(), self.time, returnLogPValues)
+
+    def drawPlan(self, clusterLabels, blockLength, numberBootstrap, rng=None):
+        # plans index positions within the window, so one plan serves every window of this length
+        return drawBootstrapPlan(self.time, clusterLabels, blockLength, numberBootstrap, rng)
+
+    def bootstrapNull(self, clusterLabels, plan):
+        """Bootstrap null of the current window, reusing a plan drawn for a window of the same length."""
+        if plan['time'] != self.time:
+            raise ValueError(f"plan was drawn for {plan['time']} rows, window has {self.time}")
+
+        return computeBootstrapNull(
+            self.panel(), clusterLabels, plan['blockLength'], planSize(plan), plan=plan
+        )
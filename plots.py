@@ -460,15 +460,23 @@ def plotCalibrationCurves(calibrationResults, savePath=None):
         'Bootstrap-RomanoWolf': 'red'
     }
 
+    # dense alpha grids come from one simulation pass: draw smooth curves with SE bands
+    dense = len(alphaLevels) > 10
+
     # fwer calibration
     for method in methods:
-        fwers = [calibrationResults[alpha][method]['fwer_mean'] for alpha in alphaLevels]
-        fwer_ses = [calibrationResults[alpha][method]['fwer_se'] for alpha in alphaLevels]
-
-        ax1.plot(alphaLevels, fwers, marker='o', label=method,
-                color=colors[method], linewidth=2, markersize=8)
-        ax1.errorbar(alphaLevels, fwers, yerr=fwer_ses, fmt='none',
-                    color=colors[method], alpha=0.3, capsize=4)
+        fwers = np.array([calibrationResults[alpha][method]['fwer_mean'] for alpha in alphaLevels])
+        fwer_ses = np.array([calibrationResults[alpha][method]['fwer_se'] for alpha in alphaLevels])
+
+        if dense:
+            ax1.plot(alphaLevels, fwers, label=method, color=colors[method], linewidth=2)
+            ax1.fill_between(alphaLevels, fwers - fwer_ses, fwers + fwer_ses,
+                            color=colors[method], alpha=0.15)
+        else:
+            ax1.plot(alphaLevels, fwers, marker='o', label=method,
+                    color=colors[method], linewidth=2, markersize=8)
+            ax1.errorbar(alphaLevels, fwers, yerr=fwer_ses, fmt='none',
+                        color=colors[method], alpha=0.3, capsize=4)
 
     # perfect calibration line
     ax1.plot([0, max(alphaLevels)], [0, max(alphaLevels)],
@@ -484,13 +492,18 @@ def plotCalibrationCurves(calibrationResults, savePath=None):
 
     # fdr calibration
     for method in methods:
-        fdrs = [calibrationResults[alpha][method]['fdr_mean'] for alpha in alphaLevels]
-        fdr_ses = [calibrationResults[alpha][method]['fdr_se'] for alpha in alphaLevels]
-
-        ax2.plot(alphaLevels, fdrs, marker='o', label=method,
-                color=colors[method], linewidth=2, markersize=8)
-        ax2.errorbar(alphaLevels, fdrs, yerr=fdr_ses, fmt='none',
-                    color=colors[method], alpha=0.3, capsize=4)
+        fdrs = np.array([calibrationResults[alpha][method]['fdr_mean'] for alpha in alphaLevels])
+        fdr_ses = np.array([calibrationResults[alpha][method]['fdr_se'] for alpha in alphaLevels])
+
+        if dense:
+            ax2.plot(alphaLevels, fdrs, label=method, color=colors[method], linewidth=2)
+            ax2.fill_between(alphaLevels, fdrs - fdr_ses, fdrs + fdr_ses,
+                            color=colors[method], alpha=0.15)
+        else:
+            ax2.plot(alphaLevels, fdrs, marker='o', label=method,
+                    color=colors[method], linewidth=2, markersize=8)
+            ax2.errorbar(alphaLevels, fdrs, yerr=fdr_ses, fmt='none',
+                        color=colors[method], alpha=0.3, capsize=4)
 
     # perfect calibration line
     ax2.plot([0, max(alphaLevels)], [0, max(alphaLevels)],
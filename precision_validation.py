@@ -0,0 +1,176 @@
+"""
+Float32 versus float64 validation of the bootstrap pipeline.
+
+Every replicate panel is simulated once in float64 and cast to float32, and
+both copies are bootstrapped with the same index plan, so any difference in
+tStar, kEff, Romano-Wolf decisions or realized FWER comes from precision alone.
+runKernelValidation likewise checks the compiled kernels against the NumPy path.
+"""
+
+import os
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from bootstrap import *
+import kernels
+from constants import (
+    TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH,
+    BASEPHI, BASERHO, ALPHA, NUMBERBOOTSTRAP, SEED, KERNEL_BACKEND, BOOTSTRAP_MEMORY_BUDGET, computeBlockLength
+)
+from random_streams import replicateGenerator
+
+PRECISIONS = ['float64', 'float32']
+
+def _bootstrapDecisions(data, clusterLabels, isTrue, alpha, blockLength, plan):
+    bootstrapNull = computeBootstrapNull(data, clusterLabels, blockLength, len(plan['blockStarts']), plan=plan)
+    performanceBoot, tStar, rejectedSingle = applyBootstrapCalibration(data, clusterLabels, isTrue, alpha, bootstrapNull=bootstrapNull)
+    performanceRW, rejectedRW, kEff = applyRomanoWolfBootstrapCalibration(data, clusterLabels, isTrue, alpha, bootstrapNull=bootstrapNull)
+
+    return {
+        'tStar': tStar,
+        'kEff': kEff,
+        'fwerSingle': performanceBoot['fwer'],
+        'fwerRomanoWolf': performanceRW['fwer'],
+        'rejectedSingle': rejectedSingle,
+        'rejectedRomanoWolf': rejectedRW
+    }
+
+def _peakBootstrapMemory(data, clusterLabels, blockLength, plan):
+    # numpy reports its buffers to tracemalloc, so this is the pipeline's peak array memory. The budget
+    # is scaled by the item size so both precisions gather the same replicates per chunk; a byte budget
+    # alone would hand float32 chunks twice as large and hide the saving
+    memoryBudget = BOOTSTRAP_MEMORY_BUDGET * data.itemsize // np.dtype('float64').itemsize
+    tracemalloc.start()
+    computeBootstrapNull(data, clusterLabels, blockLength, len(plan['blockStarts']), plan=plan, memoryBudget=memoryBudget)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak / 1024**2
+
+def runPrecisionValidation(phi=BASEPHI, rho=BASERHO, numReps=50, alpha=ALPHA, numberBootstrap=NUMBERBOOTSTRAP,
+                           blockLength=None, seed=SEED, savePath=None):
+    """Compare float32 with float64 on tStar, kEff, decisions, realized FWER, runtime and peak memory."""
+    if blockLength is None:
+        blockLength = computeBlockLength(phi)
+
+    records = {precision: [] for precision in PRECISIONS}
+    seconds = {precision: 0.0 for precision in PRECISIONS}
+    peakMB = {}
+
+    for rep in range(numReps):
+        data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
+            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho,
+            replicateGenerator(phi, rho, rep, 'data', seed), dtype='float64'
+        )
+        plan = drawBootstrapPlan(TIME, clusterLabels, blockLength, numberBootstrap, replicateGenerator(phi, rho, rep, 'bootstrap', seed))
+
+        for precision in PRECISIONS:
+            panel = data.astype(precision)
+            start = time.perf_counter()
+            records[precision].append(_bootstrapDecisions(panel, clusterLabels, isTrue, alpha, blockLength, plan))
+            seconds[precision] += time.perf_counter() - start
+
+            if rep == 0:
+                peakMB[precision] = _peakBootstrapMemory(panel, clusterLabels, blockLength, plan)
+
+    reference, single = records['float64'], records['float32']
+    rows = []
+    for metric in ['tStar', 'kEff', 'fwerSingle', 'fwerRomanoWolf']:
+        values64 = np.array([record[metric] for record in reference])
+        values32 = np.array([record[metric] for record in single])
+        rows.append({
+            'Metric': metric,
+            'float64': f"{values64.mean():.4f}",
+            'float32': f"{values32.mean():.4f}",
+            'Max_Abs_Diff': f"{np.max(np.abs(values64 - values32)):.2e}"
+        })
+
+    for method in ['Single', 'RomanoWolf']:
+        agreement = np.mean([
+            np.array_equal(r64[f'rejected{method}'], r32[f'rejected{method}']) for r64, r32 in zip(reference, single)
+        ])
+        rows.append({'Metric': f'decisionsIdentical{method}', 'float64': '-', 'float32': f"{agreement:.1%}", 'Max_Abs_Diff': '-'})
+
+    rows.append({
+        'Metric': 'secondsPerReplicate',
+        'float64': f"{seconds['float64'] / numReps:.4f}",
+        'float32': f"{seconds['float32'] / numReps:.4f}",
+        'Max_Abs_Diff': f"speedup {seconds['float64'] / seconds['float32']:.2f}x"
+    })
+    rows.append({
+        'Metric': 'peakBootstrapMB',
+        'float64': f"{peakMB['float64']:.1f}",
+        'float32': f"{peakMB['float32']:.1f}",
+        'Max_Abs_Diff': f"ratio {peakMB['float32'] / peakMB['float64']:.2f}"
+    })
+
+    dataframe = pd.DataFrame(rows)
+
+    if savePath:
+        dataframe.to_csv(savePath, index=False)
+        print(f"Table saved: {savePath}")
+
+    return dataframe
+
+def _withBackend(backend, function, *args):
+    kernels.setKernelBackend(backend)
+    try:
+        return function(*args)
+    finally:
+        kernels.setKernelBackend(KERNEL_BACKEND)
+
+def runKernelValidation(phi=BASEPHI, rho=BASERHO, numberBootstrap=NUMBERBOOTSTRAP, blockLength=None, seed=SEED, savePath=None):
+    """
+    Compile the Numba kernels and compare them with the NumPy path on one dataset:
+    panel and stacked HAC t-stats, gathered bootstrap t-stats in both precisions
+    and from a memmapped panel, and Romano-Wolf exceedance counts.
+    """
+    if kernels.numba is None:
+        raise ImportError("kernel validation requires numba")
+    if blockLength is None:
+        blockLength = computeBlockLength(phi)
+
+    data, clusterLabels, _ = generateClusteredPanelWithPlantedSignals(
+        TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho, replicateGenerator(phi, rho, 0, 'data', seed)
+    )
+    plan = drawBootstrapPlan(TIME, clusterLabels, blockLength, numberBootstrap, replicateGenerator(phi, rho, 0, 'bootstrap', seed))
+    centeredData = centerColumns(data)
+    _, stack = next(iterBootstrapChunks(centeredData, clusterLabels, plan))
+
+    absTStats = np.abs(computeTestStatistics(data)[0])
+    bootstrapAbsT = np.abs(computeBootstrapTStats(centeredData, clusterLabels, plan, 'gather', pValues=False)[0])
+    sortedIndices = np.argsort(absTStats)[::-1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        memmapped = open_memmap(os.path.join(directory, 'panel.npy'), mode='w+', dtype=centeredData.dtype, shape=centeredData.shape)
+        memmapped[:] = centeredData
+
+        checks = {
+            'hacPanel': (hacTStats, data),
+            'hacStack': (hacTStats, stack),
+            'gatheredFloat64': (lambda panel: computeBootstrapTStats(panel, clusterLabels, plan, 'gather', pValues=False)[0], centeredData),
+            'gatheredFloat32': (lambda panel: computeBootstrapTStats(panel, clusterLabels, plan, 'gather', pValues=False)[0], centeredData.astype('float32')),
+            'gatheredMemmap': (lambda panel: computeBootstrapTStats(panel, clusterLabels, plan, 'gather', pValues=False)[0], memmapped),
+            'romanoWolfCounts': (lambda boot: romanoWolfExceedanceCounts(absTStats[sortedIndices], boot[:, sortedIndices]), bootstrapAbsT)
+        }
+
+        rows = []
+        for name, (function, argument) in checks.items():
+            reference = np.asarray(_withBackend('numpy', function, argument), dtype=float)
+            compiled = np.asarray(_withBackend('numba', function, argument), dtype=float)
+            rows.append({
+                'Check': name,
+                'Max_Abs_Diff': f"{np.nanmax(np.abs(reference - compiled)):.2e}",
+                'NaN_Pattern_Equal': bool(np.array_equal(np.isnan(reference), np.isnan(compiled)))
+            })
+
+    dataframe = pd.DataFrame(rows)
+
+    if savePath:
+        dataframe.to_csv(savePath, index=False)
+        print(f"Table saved: {savePath}")
+
+    return dataframe
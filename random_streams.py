@@ -0,0 +1,31 @@
+"""
+Reproducible random streams for the Monte Carlo experiments.
+
+Every (scenario, replicate, purpose) triple gets its own numpy Generator
+spawned from one SeedSequence, so a replicate draws the same numbers no matter
+which worker runs it or how replicates are chunked.
+"""
+
+import numpy as np
+from constants import SEED
+
+PURPOSES = {'data': 0, 'bootstrap': 1, 'stability': 2}
+
+def scenarioKey(phi, rho):
+    return (int(round(phi * 1000)), int(round(rho * 1000)))
+
+def replicateGenerator(phi, rho, replicate, purpose, seed=SEED, commonRandomNumbers=False):
+    """
+    Generator for one (scenario, replicate, purpose) stream.
+
+    With commonRandomNumbers=True the scenario is left out of the key, so every
+    phi/rho level reuses the same innovations and bootstrap draws and the
+    differences between levels are not swamped by Monte Carlo noise.
+    """
+    scenario = (0, 0) if commonRandomNumbers else scenarioKey(phi, rho)
+    sequence = np.random.SeedSequence(seed, spawn_key=scenario + (replicate, PURPOSES[purpose]))
+
+    return np.random.default_rng(sequence)
+
+def replicateGenerators(phi, rho, replicates, purpose, seed=SEED, commonRandomNumbers=False):
+    return [replicateGenerator(phi, rho, rep, purpose, seed, commonRandomNumbers) for rep in replicates]
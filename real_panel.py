@@ -0,0 +1,178 @@
+"""
+Out-of-core bootstrap calibration for real return panels.
+
+A (T, K) panel is read from a memory-mapped .npy file or a Parquet file (one
+column per signal) a block of columns at a time, so peak memory is set by
+OUT_OF_CORE_COLUMN_BLOCK and BOOTSTRAP_MEMORY_BUDGET rather than by K. The HAC
+t-stat of a bootstrap column depends only on the firm it was drawn from and the
+time resample, so each block's firms are resampled in time once per replicate
+into a (B, K) memmap; the cluster draw then only gathers from that matrix.
+"""
+
+import os
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+from baseline import computeTestStatistics
+from bootstrap import (
+    drawBootstrapPlan, uniqueTimeResamples, timeResampleTStats, centerColumns, planColumnIndices, selectedClusterMaxStats,
+    effectiveNumberTests, romanoWolfExceedanceCounts, romanoWolfPAdjFromCounts
+)
+from constants import (
+    ALPHA, NUMBERBOOTSTRAP, BOOTSTRAP_MEMORY_BUDGET, OUT_OF_CORE_COLUMN_BLOCK, SEED, PRECISION, computeBlockLength
+)
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+def openPanel(path):
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ImportError("reading Parquet panels requires pyarrow")
+        return pq.ParquetFile(path)
+
+    raise ValueError(f"unsupported panel format: {path}")
+
+def panelShape(panel):
+    if isinstance(panel, np.ndarray):
+        return panel.shape
+    return panel.metadata.num_rows, len(panel.schema_arrow.names)
+
+def readPanelColumns(panel, columns, dtype=PRECISION):
+    if isinstance(panel, np.ndarray):
+        return np.array(panel[:, columns], dtype=dtype)
+
+    names = panel.schema_arrow.names[columns]
+    table = panel.read(columns=names)
+    return np.column_stack([table.column(name).to_numpy() for name in names]).astype(dtype)
+
+def loadClusterLabels(path):
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ImportError("reading Parquet labels requires pyarrow")
+        return pq.read_table(path).column(0).to_numpy()
+
+    return np.load(path)
+
+def iterColumnBlocks(K, columnBlock=OUT_OF_CORE_COLUMN_BLOCK):
+    for start in range(0, K, columnBlock):
+        yield slice(start, min(start + columnBlock, K))
+
+def estimatePanelPhi(panel, columnBlock=OUT_OF_CORE_COLUMN_BLOCK):
+    """Median lag-1 autocorrelation over all signals, for the default block length."""
+    _, K = panelShape(panel)
+    autocorrelations = []
+    for columns in iterColumnBlocks(K, columnBlock):
+        eps = readPanelColumns(panel, columns)
+        eps = eps - eps.mean(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            autocorrelations.append(np.sum(eps[1:] * eps[:-1], axis=0) / np.sum(eps**2, axis=0))
+
+    return float(np.clip(np.nanmedian(np.concatenate(autocorrelations)), 0.0, 1.0))
+
+def _rowsPerChunk(bytesPerRow, numberBootstrap, memoryBudget):
+    return int(max(1, min(numberBootstrap, memoryBudget // bytesPerRow)))
+
+def computeOutOfCoreBootstrapNull(panel, clusterLabels, blockLength, numberBootstrap, outputDir, rng=None,
+                                  columnBlock=OUT_OF_CORE_COLUMN_BLOCK, memoryBudget=BOOTSTRAP_MEMORY_BUDGET):
+    """
+    Bootstrap null of a panel on disk, with the same column semantics as computeBootstrapNull.
+
+    Writes the (B, K) bootstrap |t| matrix to outputDir/bootstrapAbsT.npy and
+    returns a dict with tStats, pVals, maxStats, rwPAdj, df and the memmapped
+    bootstrapAbsT. With clusters of unequal size, maxStats is the max over the
+    selected clusters' full membership, as in computeBootstrapNull.
+    """
+    time, K = panelShape(panel)
+    plan = drawBootstrapPlan(time, clusterLabels, blockLength, numberBootstrap, rng)
+    timePlan, timeGroups = uniqueTimeResamples(plan)
+
+    tStats, pVals = np.empty(K), np.empty(K)
+    firmPath = os.path.join(outputDir, 'firmBootstrapT.npy')
+    firmBootT = open_memmap(firmPath, mode='w+', dtype=PRECISION, shape=(len(timePlan['blockStarts']), K))
+
+    # time resampling per firm, as in the factorized scheme: only one column block of the panel is in memory
+    for columns in iterColumnBlocks(K, columnBlock):
+        block = readPanelColumns(panel, columns)
+        tStats[columns], pVals[columns] = computeTestStatistics(block)
+        firmBootT[:, columns] = timeResampleTStats(centerColumns(block), timePlan, memoryBudget, pValues=False)[0]
+
+    # cluster resampling gathers positional columns from the per-firm matrix
+    bootstrapAbsT = open_memmap(os.path.join(outputDir, 'bootstrapAbsT.npy'), mode='w+', dtype=PRECISION, shape=(numberBootstrap, K))
+    absTStats = np.abs(tStats)
+    sortedIndices = np.argsort(absTStats)[::-1]
+    counts = np.zeros(K, dtype=np.int64)
+    maxStats = np.empty(numberBootstrap)
+
+    rowsPerChunk = _rowsPerChunk(3 * K * 8, numberBootstrap, memoryBudget)
+    for start in range(0, numberBootstrap, rowsPerChunk):
+        rows = slice(start, min(start + rowsPerChunk, numberBootstrap))
+        firmRows = np.asarray(firmBootT[timeGroups[rows]])
+        chunkAbsT = np.abs(np.take_along_axis(firmRows, planColumnIndices(plan, clusterLabels, rows), axis=1))
+        bootstrapAbsT[rows] = chunkAbsT
+        counts += romanoWolfExceedanceCounts(absTStats[sortedIndices], chunkAbsT[:, sortedIndices])
+        maxStats[rows] = selectedClusterMaxStats(
+            firmRows, np.arange(len(firmRows)), clusterLabels, {'selectedClusters': plan['selectedClusters'][rows]}
+        )
+
+    bootstrapAbsT.flush()
+    del firmBootT
+    os.remove(firmPath)
+
+    return {
+        'tStats': tStats,
+        'pVals': pVals,
+        'bootstrapAbsT': bootstrapAbsT,
+        'maxStats': maxStats,
+        'rwPAdj': romanoWolfPAdjFromCounts(counts, numberBootstrap, sortedIndices),
+        'df': time - 1,
+        'numberBootstrap': numberBootstrap
+    }
+
+def runRealPanelCalibration(panelPath, labelsPath, outputDir, alpha=ALPHA, numberBootstrap=NUMBERBOOTSTRAP,
+                            blockLength=None, seed=SEED):
+    """Romano-Wolf and single-step calibration of a panel on disk; results are written to outputDir."""
+    os.makedirs(outputDir, exist_ok=True)
+    panel = openPanel(panelPath)
+    clusterLabels = loadClusterLabels(labelsPath)
+    time, K = panelShape(panel)
+
+    if len(clusterLabels) != K:
+        raise ValueError(f"{len(clusterLabels)} cluster labels for {K} signals")
+    if blockLength is None:
+        phi = estimatePanelPhi(panel)
+        blockLength = computeBlockLength(phi)
+        print(f"Using block length = {blockLength} (median lag-1 autocorrelation {phi:.3f})")
+
+    bootstrapNull = computeOutOfCoreBootstrapNull(
+        panel, clusterLabels, blockLength, numberBootstrap, outputDir, np.random.default_rng(seed)
+    )
+
+    tStar = np.percentile(bootstrapNull['maxStats'], 100 * (1 - alpha))
+    kEff = effectiveNumberTests(bootstrapNull['maxStats'], alpha, K, bootstrapNull['df'])
+
+    np.save(os.path.join(outputDir, 'tStats.npy'), bootstrapNull['tStats'])
+    np.save(os.path.join(outputDir, 'pVals.npy'), bootstrapNull['pVals'])
+    np.save(os.path.join(outputDir, 'rwPAdj.npy'), bootstrapNull['rwPAdj'])
+
+    summary = {
+        'time': int(time),
+        'signals': int(K),
+        'alpha': alpha,
+        'numberBootstrap': numberBootstrap,
+        'blockLength': int(blockLength),
+        'tStar': float(tStar),
+        'kEff': float(kEff),
+        'rejectedSingle': int(np.sum(np.abs(bootstrapNull['tStats']) > tStar)),
+        'rejectedRomanoWolf': int(np.sum(bootstrapNull['rwPAdj'] < alpha))
+    }
+    with open(os.path.join(outputDir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Results saved: {outputDir}")
+
+    return summary
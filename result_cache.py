@@ -0,0 +1,143 @@
+"""
+Content-addressed cache of scenario results.
+
+A work unit's merged accumulators are stored under a hash of its resolved
+configuration: the accumulate function with every argument bound (defaults
+included), the replicate count, the constants that reach the numbers without
+passing through those arguments, the block-length rule and a hash of the
+method source code. Only changes that can alter a unit's numbers change its
+key, so stale results are never served, while editing unrelated constants
+(e.g. adding a sweep level) still hits the cache for unchanged scenarios.
+"""
+
+import os
+import json
+import pickle
+import inspect
+import hashlib
+from functools import lru_cache
+import numpy as np
+from kernels import activeKernelBackend
+from constants import (
+    TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, PRECISION, HAC_MAX_LAG, HAC_MAX_AUTO_LAG,
+    HAC_FFT_MIN_LAG, BOOTSTRAP_SCHEME, CLUSTER_DRAWS_PER_TIME_RESAMPLE, SEQUENTIAL_BOOTSTRAP_BATCH,
+    SEQUENTIAL_BOOTSTRAP_CONFIDENCE, SEQUENTIAL_BOOTSTRAP_EXCEEDANCES, HISTOGRAM_BINS, TSTAR_HISTOGRAM_MAX,
+    MIN_BLOCKLENGTH, MAX_BLOCKLENGTH, computeBlockLength,
+    RESULT_CACHE_ENABLED, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_EVICTION
+)
+
+# modules whose code determines the numbers; plotting and scheduling do not. constants.py is
+# covered by resultConstants() instead, so that unrelated edits there keep their cache entries
+CODE_VERSION_SOURCES = [
+    'accumulators.py', 'baseline.py', 'bootstrap.py', 'calibration_curves.py',
+    'generateSyntheticData.py', 'kernels.py', 'random_streams.py', 'stability_analysis.py'
+]
+
+def resultConstants():
+    """
+    Constants used below the accumulate functions' arguments, with the block-length
+    rule and the kernel backend in use, which setKernelBackend can change at run time.
+    """
+    return {
+        'data': [TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, PRECISION],
+        'hac': [HAC_MAX_LAG, HAC_MAX_AUTO_LAG, HAC_FFT_MIN_LAG, activeKernelBackend()],
+        'bootstrap': [BOOTSTRAP_SCHEME, CLUSTER_DRAWS_PER_TIME_RESAMPLE, SEQUENTIAL_BOOTSTRAP_BATCH,
+                      SEQUENTIAL_BOOTSTRAP_CONFIDENCE, SEQUENTIAL_BOOTSTRAP_EXCEEDANCES],
+        'histograms': [HISTOGRAM_BINS, TSTAR_HISTOGRAM_MAX],
+        'blockLength': [MIN_BLOCKLENGTH, MAX_BLOCKLENGTH, inspect.getsource(computeBlockLength)]
+    }
+
+@lru_cache(maxsize=None)
+def codeVersion():
+    digest = hashlib.sha256()
+    sourceDir = os.path.dirname(os.path.abspath(__file__))
+    for fileName in CODE_VERSION_SOURCES:
+        with open(os.path.join(sourceDir, fileName), 'rb') as f:
+            digest.update(fileName.encode() + b'\0' + f.read())
+
+    return digest.hexdigest()
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return repr(value)
+
+def resolvedUnitConfig(accumulate, phi, rho, kwargs):
+    """
+    Everything that determines a work unit's numbers apart from its replicate range,
+    as plain JSON: arguments omitted by the caller appear with their default values.
+    """
+    arguments = inspect.signature(accumulate).bind(phi, rho, None, **kwargs)
+    arguments.apply_defaults()
+    arguments = dict(arguments.arguments)
+    del arguments['replicates']
+
+    config = {
+        'accumulate': accumulate.__name__,
+        'arguments': arguments,
+        'constants': resultConstants(),
+        'codeVersion': codeVersion()
+    }
+
+    return json.loads(json.dumps(config, sort_keys=True, default=_jsonable))
+
+def unitCacheKey(accumulate, phi, rho, numReps, kwargs):
+    config = dict(resolvedUnitConfig(accumulate, phi, rho, kwargs), numReps=numReps)
+    encoded = json.dumps(config, sort_keys=True)
+
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+def loadCachedResult(key, cacheDir=RESULT_CACHE_DIR, eviction=RESULT_CACHE_EVICTION):
+    path = os.path.join(cacheDir, f"{key}.pkl")
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        result = pickle.load(f)
+    if eviction == 'lru':
+        os.utime(path)
+
+    return result
+
+def evictCache(cacheDir=RESULT_CACHE_DIR, maxBytes=RESULT_CACHE_MAX_BYTES, eviction=RESULT_CACHE_EVICTION):
+    """Delete entries, least recently used or oldest first, until the cache fits in maxBytes."""
+    if eviction == 'none' or not os.path.isdir(cacheDir):
+        return
+
+    entries = []
+    for fileName in os.listdir(cacheDir):
+        if fileName.endswith('.pkl'):
+            stat = os.stat(os.path.join(cacheDir, fileName))
+            entries.append((stat.st_mtime, stat.st_size, fileName))
+
+    totalBytes = sum(size for _, size, _ in entries)
+    # hits touch the file under 'lru', so mtime is the last use there and the write time under 'fifo'
+    for _, size, fileName in sorted(entries):
+        if totalBytes <= maxBytes:
+            break
+        os.remove(os.path.join(cacheDir, fileName))
+        totalBytes -= size
+
+def storeCachedResult(key, result, cacheDir=RESULT_CACHE_DIR, maxBytes=RESULT_CACHE_MAX_BYTES, eviction=RESULT_CACHE_EVICTION):
+    os.makedirs(cacheDir, exist_ok=True)
+    path = os.path.join(cacheDir, f"{key}.pkl")
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(path + '.tmp', path)
+
+    evictCache(cacheDir, maxBytes, eviction)
+
+def cachedAccumulate(accumulate, phi, rho, numReps, kwargs, useCache=RESULT_CACHE_ENABLED):
+    """accumulate(phi, rho, range(numReps), **kwargs), served from the cache when the configuration is unchanged."""
+    if not useCache:
+        return accumulate(phi, rho, range(numReps), **kwargs)
+
+    key = unitCacheKey(accumulate, phi, rho, numReps, kwargs)
+    result = loadCachedResult(key)
+    if result is None:
+        result = accumulate(phi, rho, range(numReps), **kwargs)
+        storeCachedResult(key, result)
+
+    return result
@@ -0,0 +1,222 @@
+"""
+Replicate-chunk scheduling for the Monte Carlo stages.
+
+Every work unit (one scenario of one stage) is split into small replicate
+chunks. The chunks of all work units share one process pool sized to the
+machine, and their accumulators are merged back per work unit in replicate
+order. Wall time then scales with core count rather than with the number
+of scenarios, and results do not depend on the worker count. Workers run the
+parent's kernel backend, with the compiled kernels' threads split between them.
+accumulateAdaptively instead runs one unit in batches until a precision
+target or a time budget is reached.
+
+With a checkpoint directory every finished chunk is written to disk, keyed by
+work unit and replicate range, so an interrupted run can be resumed and a
+finished run can be extended with more replicates. Each unit directory records
+the unit's resolved configuration (as for the cache key, without the replicate
+count), and resuming against a different one raises instead of mixing chunks. Units whose configuration
+is already in the result cache are not scheduled at all.
+"""
+
+import os
+import copy
+import json
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from accumulators import mergeAccumulatorTrees
+from result_cache import resolvedUnitConfig, unitCacheKey, loadCachedResult, storeCachedResult
+from kernels import activeKernelBackend, configureWorker
+from constants import (
+    REPLICATE_CHUNK_SIZE, RESULT_CACHE_ENABLED, ADAPTIVE_BATCH_SIZE, ADAPTIVE_MIN_REPS, ADAPTIVE_MAX_REPS
+)
+
+def splitReplicates(numReps, chunkSize=REPLICATE_CHUNK_SIZE, start=0):
+    return [range(s, min(s + chunkSize, numReps)) for s in range(start, numReps, chunkSize)]
+
+def _runChunk(task):
+    key, accumulate, phi, rho, replicates, kwargs = task
+    return key, replicates, accumulate(phi, rho, replicates, **kwargs)
+
+def _unitName(key, accumulate):
+    parts = key if isinstance(key, tuple) else (key,)
+    return '_'.join([accumulate.__name__] + [str(part) for part in parts])
+
+def _prepareCheckpointDir(unitDir, config, resume):
+    configPath = os.path.join(unitDir, 'config.json')
+
+    if os.path.isdir(unitDir) and not resume:
+        shutil.rmtree(unitDir)
+
+    if os.path.exists(configPath):
+        with open(configPath) as f:
+            if json.load(f) != config:
+                raise ValueError(f"checkpoint {unitDir} was written with a different configuration")
+    else:
+        os.makedirs(unitDir, exist_ok=True)
+        with open(configPath, 'w') as f:
+            json.dump(config, f)
+
+def _loadCheckpoints(unitDir, numReps):
+    """Checkpointed chunks as {start: (replicates, accumulators)}, non-overlapping and within numReps."""
+    ranges = []
+    for fileName in os.listdir(unitDir):
+        if fileName.endswith('.pkl'):
+            start, stop = (int(part) for part in fileName[:-4].split('-'))
+            if stop <= numReps:
+                ranges.append(range(start, stop))
+
+    loaded = {}
+    covered = 0
+    for replicates in sorted(ranges, key=lambda r: (r.start, -r.stop)):
+        if replicates.start < covered:
+            continue
+        with open(os.path.join(unitDir, f"{replicates.start}-{replicates.stop}.pkl"), 'rb') as f:
+            loaded[replicates.start] = (replicates, pickle.load(f))
+        covered = replicates.stop
+
+    return loaded
+
+def _saveCheckpoint(unitDir, replicates, accumulators):
+    path = os.path.join(unitDir, f"{replicates.start}-{replicates.stop}.pkl")
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(accumulators, f)
+    os.replace(path + '.tmp', path)
+
+def _missingRanges(loaded, numReps, chunkSize):
+    missing = []
+    position = 0
+    for start in sorted(loaded):
+        missing += splitReplicates(start, chunkSize, position)
+        position = loaded[start][0].stop
+    missing += splitReplicates(numReps, chunkSize, position)
+
+    return missing
+
+def runChunkedWorkUnits(workUnits, chunkSize=REPLICATE_CHUNK_SIZE, maxWorkers=None, checkpointDir=None, resume=False,
+                        useCache=RESULT_CACHE_ENABLED):
+    """
+    Run work units as replicate chunks on a shared process pool.
+
+    workUnits maps a key to (accumulate, phi, rho, numReps, kwargs), where
+    accumulate(phi, rho, replicates, **kwargs) returns mergeable accumulators.
+    Units listed first are queued first, so put the most expensive ones first.
+
+    With checkpointDir, each finished chunk is saved under the unit's directory.
+    resume=True reuses chunks already on disk and only runs the missing replicate
+    ranges, which also extends a finished run when numReps has grown; otherwise
+    old checkpoints of these units are discarded. With useCache, units found in the
+    result cache are loaded and finished units are stored there. Units with the
+    same cache key, such as a grid point shared by two sweeps, run once.
+    Returns {key: merged accumulators}.
+    """
+    maxWorkers = maxWorkers or os.cpu_count() or 1
+
+    cacheKeys = {key: unitCacheKey(accumulate, phi, rho, numReps, kwargs)
+                 for key, (accumulate, phi, rho, numReps, kwargs) in workUnits.items()}
+    # duplicates of an earlier unit take a copy of its result at the end
+    firstKeys = {}
+    duplicates = {}
+    for key, cacheKey in cacheKeys.items():
+        if cacheKey in firstKeys:
+            duplicates[key] = firstKeys[cacheKey]
+        else:
+            firstKeys[cacheKey] = key
+    workUnits = {key: unit for key, unit in workUnits.items() if key not in duplicates}
+
+    merged = {}
+    if useCache:
+        for key in workUnits:
+            cached = loadCachedResult(cacheKeys[key])
+            if cached is not None:
+                merged[key] = cached
+        workUnits = {key: unit for key, unit in workUnits.items() if key not in merged}
+
+    unitDirs = {}
+    pending = {key: {} for key in workUnits}
+    tasks = []
+
+    for key, (accumulate, phi, rho, numReps, kwargs) in workUnits.items():
+        if checkpointDir is not None:
+            unitDirs[key] = os.path.join(checkpointDir, _unitName(key, accumulate))
+            _prepareCheckpointDir(unitDirs[key], resolvedUnitConfig(accumulate, phi, rho, kwargs), resume)
+            pending[key] = _loadCheckpoints(unitDirs[key], numReps)
+
+        for replicates in _missingRanges(pending[key], numReps, chunkSize):
+            tasks.append((key, accumulate, phi, rho, replicates, kwargs))
+
+    # round-robin over units so every scenario makes progress and the tail is short
+    tasks.sort(key=lambda task: task[4].start)
+
+    nextStart = {key: 0 for key in workUnits}
+
+    def mergeReady(key):
+        # merge strictly in replicate order so results are bit-identical for any worker count
+        while nextStart[key] in pending[key]:
+            replicates, accumulators = pending[key].pop(nextStart[key])
+            merged[key] = accumulators if key not in merged else mergeAccumulatorTrees(merged[key], accumulators)
+            nextStart[key] = replicates.stop
+
+    for key in workUnits:
+        mergeReady(key)
+
+    if tasks:
+        # workers split the cores between them, so compiled kernels do not oversubscribe the machine
+        threadsPerWorker = max(1, (os.cpu_count() or 1) // maxWorkers)
+        with ProcessPoolExecutor(max_workers=maxWorkers, initializer=configureWorker,
+                                 initargs=(activeKernelBackend(), threadsPerWorker)) as executor:
+            futures = [executor.submit(_runChunk, task) for task in tasks]
+
+            for future in as_completed(futures):
+                key, replicates, accumulators = future.result()
+                if key in unitDirs:
+                    _saveCheckpoint(unitDirs[key], replicates, accumulators)
+
+                pending[key][replicates.start] = (replicates, accumulators)
+                mergeReady(key)
+
+    for key in workUnits:
+        if useCache:
+            storeCachedResult(cacheKeys[key], merged[key])
+
+    for key, firstKey in duplicates.items():
+        merged[key] = copy.deepcopy(merged[firstKey])
+
+    return merged
+
+def accumulateAdaptively(accumulate, phi, rho, kwargs, precision, targetSE=None, timeBudget=None,
+                         batchSize=ADAPTIVE_BATCH_SIZE, minReps=ADAPTIVE_MIN_REPS, maxReps=ADAPTIVE_MAX_REPS,
+                         useCache=RESULT_CACHE_ENABLED):
+    """
+    Run replicate batches until precision(accumulators) <= targetSE or the time budget is spent.
+
+    The budget in seconds is respected by not starting a batch that the last
+    batch's duration says would overrun it. Replicates keep their own random
+    streams, so stopping at n replicates gives exactly the fixed-n result, which
+    is also stored in the result cache under that n. Returns (accumulators, numReps).
+    """
+    if targetSE is None and timeBudget is None:
+        raise ValueError("adaptive stopping needs a targetSE or a timeBudget")
+
+    startTime = time.perf_counter()
+    accumulators = None
+    numReps = 0
+
+    while numReps < maxReps:
+        batchStart = time.perf_counter()
+        batch = range(numReps, min(numReps + batchSize, maxReps))
+        batchAccumulators = accumulate(phi, rho, batch, **kwargs)
+        accumulators = batchAccumulators if accumulators is None else mergeAccumulatorTrees(accumulators, batchAccumulators)
+        numReps = batch.stop
+
+        now = time.perf_counter()
+        if timeBudget is not None and now - startTime + (now - batchStart) > timeBudget:
+            break
+        if targetSE is not None and numReps >= minReps and precision(accumulators) <= targetSE:
+            break
+
+    if useCache:
+        storeCachedResult(unitCacheKey(accumulate, phi, rho, numReps, kwargs), accumulators)
+
+    return accumulators, numReps
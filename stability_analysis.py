@@ -5,69 +5,18 @@ from bootstrap import *
 from generateSyntheticData import *
 from constants import (
     TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH,
-    ALPHALEVELS, NUMBERREPS_STABILITY, NUMBERBOOTSTRAP_STABILITY, computeBlockLength
+    ALPHALEVELS, NUMBERREPS_STABILITY, NUMBERBOOTSTRAP_STABILITY, computeBlockLength,
+    SEED, COMMON_RANDOM_NUMBERS, JOINT_STABILITY_RESAMPLING
 )
+from random_streams import replicateGenerator
+from accumulators import MetricAccumulator, replicateCount
+from scheduler import runChunkedWorkUnits, accumulateAdaptively
+from result_cache import cachedAccumulate
 
-def analyzeDiscoveryStability(data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap=NUMBERBOOTSTRAP_STABILITY, method='Bootstrap-RomanoWolf'):
-    """
-    Measure discovery stability: "Do rejections from original data persist in resamples?"
+STABILITY_METHODS = ['Bonferroni', 'Holm', 'BH', 'Bootstrap-Single', 'Bootstrap-RomanoWolf']
 
-    KEY CONCEPT: Resample ORIGINAL data (preserving signal structure) and count how often
-    each hypothesis gets rejected across bootstrap samples. True signals should have high
-    survivor rates; false positives should be fragile.
-
-    This is NOT a null bootstrap - we preserve the planted signals to test reproducibility.
-    """
-    K = data.shape[1]
-
-    # original data rejections
-    tStats, pVals = computeTestStatistics(data)
-
-    if method == 'Bonferroni':
-        originalRejected = bonferroni(pVals, alpha)
-    elif method == 'Holm':
-        originalRejected = holm(pVals, alpha)
-    elif method == 'BH':
-        originalRejected = benjaminiHochberg(pVals, alpha)
-    elif method == 'Bootstrap-Single':
-        _, _, originalRejected = applyBootstrapCalibration(data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap)
-    elif method == 'Bootstrap-RomanoWolf':
-        _, originalRejected, _ = applyRomanoWolfBootstrapCalibration(data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap)
-    else:
-        raise ValueError(f"Unknown method: {method}")
-
-    # CRITICAL FIX: Resample ORIGINAL data (not centered!) to preserve signal structure
-    # This tests: "Do my discoveries persist when I perturb the data?"
-    bootstrapSamples = movingBlockClusterBootstrap(data, clusterLabels, blockLength, numberBootstrap)
-
-    rejectionMatrix = np.zeros((numberBootstrap, K), dtype=bool)
-    pvalMatrix = np.zeros((numberBootstrap, K))
-
-    # For bootstrap methods, compute threshold once from original data
-    if method == 'Bootstrap-Single':
-        _, tStar, _ = applyBootstrapCalibration(data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap)
-
-    for b, bootData in enumerate(bootstrapSamples):
-        bootTStats, bootPVals = computeTestStatistics(bootData)
-        pvalMatrix[b, :] = bootPVals
-
-        if method == 'Bonferroni':
-            rejectionMatrix[b, :] = bonferroni(bootPVals, alpha)
-        elif method == 'Holm':
-            rejectionMatrix[b, :] = holm(bootPVals, alpha)
-        elif method == 'BH':
-            rejectionMatrix[b, :] = benjaminiHochberg(bootPVals, alpha)
-        elif method == 'Bootstrap-Single':
-            # Use pre-computed tStar from original data
-            rejectionMatrix[b, :] = np.abs(bootTStats) > tStar
-        elif method == 'Bootstrap-RomanoWolf':
-            # For RW, use simple percentile threshold to avoid bootstrap-within-bootstrap
-            threshold = np.percentile(np.abs(bootTStats), 100 * (1 - alpha))
-            rejectionMatrix[b, :] = np.abs(bootTStats) > threshold
-
-    # compute stability metrics
+def summarizeStability(originalRejected, rejectionMatrix, iqrBootP, isTrue):
     survivorRate = np.mean(rejectionMatrix, axis=0)
-    iqrBootP = np.percentile(pvalMatrix, 75, axis=0) - np.percentile(pvalMatrix, 25, axis=0)
 
     trueAltSurvivor = survivorRate[isTrue]
     nullSurvivor = survivorRate[~isTrue]
@@ -86,6 +35,91 @@ def analyzeDiscoveryStability(data, clusterLabels, isTrue, alpha, blockLength, n
         'nullSurvivorMedian': np.median(nullSurvivor) if len(nullSurvivor) > 0 else np.nan,
     }
 
+def analyzeDiscoveryStabilityAllMethods(data, clusterLabels, isTrue, alphaLevels, blockLength, numberBootstrap=NUMBERBOOTSTRAP_STABILITY,
+                                        methods=STABILITY_METHODS, rng=None, joint=JOINT_STABILITY_RESAMPLING):
+    """
+    Discovery stability of several methods at several alphas from one shared state.
+
+    The dataset gets one bootstrap null (for the bootstrap methods' original
+    rejections) and one signal-preserving resample set whose t-stats and p-values
+    are computed once. Every (alpha, method) pair is then evaluated from those
+    arrays. With joint, both come from a single plan that shares the HAC
+    standard errors (see computeJointBootstrapTStats), roughly halving the
+    bootstrap work. Returns {(alpha, method): stability dict} as in analyzeDiscoveryStability.
+    """
+    for method in methods:
+        if method not in STABILITY_METHODS:
+            raise ValueError(f"Unknown method: {method}")
+
+    if joint:
+        tStats, pVals = computeTestStatistics(data)
+        plan = drawBootstrapPlan(data.shape[0], clusterLabels, blockLength, numberBootstrap, rng)
+        nullT, bootTStatMatrix, pvalMatrix = computeJointBootstrapTStats(data, clusterLabels, plan)
+        bootstrapNull = assembleBootstrapNull(tStats, pVals, nullT, data.shape[0] - 1, plan)
+    else:
+        # original data statistics
+        if any('Bootstrap' in method for method in methods):
+            bootstrapNull = computeBootstrapNull(data, clusterLabels, blockLength, numberBootstrap, rng=rng)
+            tStats, pVals = bootstrapNull['tStats'], bootstrapNull['pVals']
+        else:
+            tStats, pVals = computeTestStatistics(data)
+
+        # CRITICAL FIX: Resample ORIGINAL data (not centered!) to preserve signal structure
+        # This tests: "Do my discoveries persist when I perturb the data?"
+        plan = drawBootstrapPlan(data.shape[0], clusterLabels, blockLength, numberBootstrap, rng)
+        bootTStatMatrix, pvalMatrix = computeBootstrapTStats(data, clusterLabels, plan)
+    absBootTStats = np.abs(bootTStatMatrix)
+
+    # p-value spread does not depend on the method or alpha
+    iqrBootP = np.percentile(pvalMatrix, 75, axis=0) - np.percentile(pvalMatrix, 25, axis=0)
+
+    # classical procedures for every alpha and resample in one batched call each, in t-space
+    df = max(1, data.shape[0] - 1)
+    originalClassical = {}
+    bootClassical = {}
+    for method in methods:
+        if method in CLASSICAL_BATCH_METHODS:
+            originalClassical[method] = CLASSICAL_BATCH_METHODS[method](tStats, alphaLevels, df)[:, 0]
+            bootClassical[method] = CLASSICAL_BATCH_METHODS[method](bootTStatMatrix, alphaLevels, df)
+
+    allResults = {}
+
+    for a, alpha in enumerate(alphaLevels):
+        for method in methods:
+            if method in CLASSICAL_BATCH_METHODS:
+                originalRejected = originalClassical[method][a]
+                rejectionMatrix = bootClassical[method][a]
+            elif method == 'Bootstrap-Single':
+                # tStar from the original data is the threshold for every resample
+                _, tStar, originalRejected = applyBootstrapCalibration(data, clusterLabels, isTrue, alpha, bootstrapNull=bootstrapNull)
+                rejectionMatrix = absBootTStats > tStar
+            else:
+                _, originalRejected, _ = applyRomanoWolfBootstrapCalibration(data, clusterLabels, isTrue, alpha, bootstrapNull=bootstrapNull)
+                # For RW, use simple percentile threshold to avoid bootstrap-within-bootstrap
+                thresholds = np.percentile(absBootTStats, 100 * (1 - alpha), axis=1)
+                rejectionMatrix = absBootTStats > thresholds[:, None]
+
+            allResults[(alpha, method)] = summarizeStability(originalRejected, rejectionMatrix, iqrBootP, isTrue)
+
+    return allResults
+
+def analyzeDiscoveryStability(data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap=NUMBERBOOTSTRAP_STABILITY, method='Bootstrap-RomanoWolf', rng=None,
+                              joint=JOINT_STABILITY_RESAMPLING):
+    """
+    Measure discovery stability: "Do rejections from original data persist in resamples?"
+
+    KEY CONCEPT: Resample ORIGINAL data (preserving signal structure) and count how often
+    each hypothesis gets rejected across bootstrap samples. True signals should have high
+    survivor rates; false positives should be fragile.
+
+    This is NOT a null bootstrap - we preserve the planted signals to test reproducibility.
+    """
+    allResults = analyzeDiscoveryStabilityAllMethods(
+        data, clusterLabels, isTrue, [alpha], blockLength, numberBootstrap, [method], rng, joint
+    )
+
+    return allResults[(alpha, method)]
+
 def createStabilityTable(stabilityResults, savePath=None):
     rows = []
 
@@ -99,7 +133,8 @@ def createStabilityTable(stabilityResults, savePath=None):
             'Null_Survivor_SE': f"{stats['nullSurvivorSE']:.3f}",
             'TrueAlt_IQR': f"{stats['trueAltIQRMean']:.3f}",
             'Null_IQR': f"{stats['nullIQRMean']:.3f}",
-            'Stability_Ratio': f"{stats['trueAltSurvivorMean'] / max(stats['nullSurvivorMean'], 0.001):.2f}"
+            'Stability_Ratio': f"{stats['trueAltSurvivorMean'] / max(stats['nullSurvivorMean'], 0.001):.2f}",
+            'Reps': stats['numReps']
         }
         rows.append(row)
 
@@ -116,53 +151,90 @@ def createStabilityTable(stabilityResults, savePath=None):
 
     return df
 
-def runStabilityExperiment(phi, rho, alphaLevels=ALPHALEVELS, numReps=NUMBERREPS_STABILITY, numberBootstrap=NUMBERBOOTSTRAP_STABILITY, blockLength=None):
-    # Compute optimal block length based on phi if not provided
+STABILITY_METRICS = ['trueAltSurvivorMean', 'nullSurvivorMean', 'trueAltIQRMean', 'nullIQRMean',
+                     'trueAltSurvivorMedian', 'nullSurvivorMedian']
+
+def accumulateStability(phi, rho, replicates, alphaLevels=ALPHALEVELS, numberBootstrap=NUMBERBOOTSTRAP_STABILITY, blockLength=None,
+                        seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS, joint=JOINT_STABILITY_RESAMPLING):
+    """Run the replicates in a range and return accumulators keyed by (alpha, method)."""
     if blockLength is None:
         blockLength = computeBlockLength(phi)
-        print(f"Using block length = {blockLength} (computed from phi={phi})")
 
-    methods = ['Bonferroni', 'Holm', 'BH', 'Bootstrap-Single', 'Bootstrap-RomanoWolf']
+    accumulators = {
+        (alpha, method): {metric: MetricAccumulator() for metric in STABILITY_METRICS}
+        for alpha in alphaLevels for method in STABILITY_METHODS
+    }
+
+    # each panel and resample set is shared by every (alpha, method) pair
+    for rep in replicates:
+        dataRng = replicateGenerator(phi, rho, rep, 'data', seed, commonRandomNumbers)
+        stabilityRng = replicateGenerator(phi, rho, rep, 'stability', seed, commonRandomNumbers)
+
+        data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
+            TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho, dataRng
+        )
+
+        stability = analyzeDiscoveryStabilityAllMethods(
+            data, clusterLabels, isTrue, alphaLevels, blockLength, numberBootstrap, STABILITY_METHODS, stabilityRng, joint
+        )
+
+        for key, stats in stability.items():
+            for metric in STABILITY_METRICS:
+                accumulators[key][metric].update(stats[metric])
+
+    return accumulators
 
+def stabilityPrecision(accumulators):
+    """Largest survivor-rate standard error over the (alpha, method) pairs."""
+    return np.nanmax([
+        [metrics['trueAltSurvivorMean'].standardError(), metrics['nullSurvivorMean'].standardError()]
+        for metrics in accumulators.values()
+    ])
+
+def summarizeStabilityAccumulators(accumulators):
     allResults = {}
+    numReps = replicateCount(accumulators)
+    for key, metrics in accumulators.items():
+        summary = {metric: metrics[metric].finalMean() for metric in STABILITY_METRICS}
+        summary['trueAltSurvivorSE'] = metrics['trueAltSurvivorMean'].standardError()
+        summary['nullSurvivorSE'] = metrics['nullSurvivorMean'].standardError()
+        summary['numReps'] = numReps
 
-    for alpha in alphaLevels:
-        print(f"Stability analysis for alpha = {alpha:.3f}...")
+        allResults[key] = summary
 
-        for method in methods:
-            results = {
-                'trueAltSurvivorMean': [],
-                'nullSurvivorMean': [],
-                'trueAltIQRMean': [],
-                'nullIQRMean': [],
-                'trueAltSurvivorMedian': [],
-                'nullSurvivorMedian': []
-            }
-
-            for rep in range(numReps):
-                data, clusterLabels, isTrue = generateClusteredPanelWithPlantedSignals(
-                    TIME, NUMBERCLUSTERS, FIRMSPERCLUSTER, NUMBERTRUE, STRENGTH, phi, rho
-                )
-
-                stability = analyzeDiscoveryStability(data, clusterLabels, isTrue, alpha, blockLength, numberBootstrap, method)
-
-                results['trueAltSurvivorMean'].append(stability['trueAltSurvivorMean'])
-                results['nullSurvivorMean'].append(stability['nullSurvivorMean'])
-                results['trueAltIQRMean'].append(stability['trueAltIQRMean'])
-                results['nullIQRMean'].append(stability['nullIQRMean'])
-                results['trueAltSurvivorMedian'].append(stability['trueAltSurvivorMedian'])
-                results['nullSurvivorMedian'].append(stability['nullSurvivorMedian'])
-
-            summary = {
-                'trueAltSurvivorMean': np.nanmean(results['trueAltSurvivorMean']),
-                'nullSurvivorMean': np.nanmean(results['nullSurvivorMean']),
-                'trueAltIQRMean': np.nanmean(results['trueAltIQRMean']),
-                'nullIQRMean': np.nanmean(results['nullIQRMean']),
-                'trueAltSurvivorMedian': np.nanmean(results['trueAltSurvivorMedian']),
-                'nullSurvivorMedian': np.nanmean(results['nullSurvivorMedian']),
-                'trueAltSurvivorSE': np.nanstd(results['trueAltSurvivorMean']) / np.sqrt(numReps),
-                'nullSurvivorSE': np.nanstd(results['nullSurvivorMean']) / np.sqrt(numReps),
-            }
-
-            allResults[(alpha, method)] = summary
     return allResults
+
+def runStabilityExperiment(phi, rho, alphaLevels=ALPHALEVELS, numReps=NUMBERREPS_STABILITY, numberBootstrap=NUMBERBOOTSTRAP_STABILITY, blockLength=None,
+                           seed=SEED, commonRandomNumbers=COMMON_RANDOM_NUMBERS, targetSE=None, timeBudget=None):
+    # Compute optimal block length based on phi if not provided
+    if blockLength is None:
+        blockLength = computeBlockLength(phi)
+        print(f"Using block length = {blockLength} (computed from phi={phi})")
+
+    print(f"Stability analysis for alpha in {list(alphaLevels)}...")
+
+    kwargs = {
+        'alphaLevels': list(alphaLevels), 'numberBootstrap': numberBootstrap, 'blockLength': blockLength,
+        'seed': seed, 'commonRandomNumbers': commonRandomNumbers
+    }
+    # with targetSE or timeBudget (seconds) stop once the survivor-rate SEs are small enough
+    if targetSE is None and timeBudget is None:
+        accumulators = cachedAccumulate(accumulateStability, phi, rho, numReps, kwargs)
+    else:
+        accumulators, numReps = accumulateAdaptively(
+            accumulateStability, phi, rho, kwargs, stabilityPrecision, targetSE, timeBudget
+        )
+        print(f"stopped after {numReps} replicates")
+
+    return summarizeStabilityAccumulators(accumulators)
+
+def runStabilityScenariosParallel(scenarios, alphaLevels=ALPHALEVELS, numReps=NUMBERREPS_STABILITY, maxWorkers=None,
+                                  checkpointDir=None, resume=False):
+    """Stability results for (phi, rho, ...) scenarios, run as replicate chunks on all cores."""
+    workUnits = {
+        (phi, rho): (accumulateStability, phi, rho, numReps, {'alphaLevels': alphaLevels})
+        for phi, rho, *_ in scenarios
+    }
+    merged = runChunkedWorkUnits(workUnits, maxWorkers=maxWorkers, checkpointDir=checkpointDir, resume=resume)
+
+    return [summarizeStabilityAccumulators(merged[(phi, rho)]) for phi, rho, *_ in scenarios]